@@ -1,6 +1,9 @@
 #coding: latin-1
 
+import time
+
 import matplotlib.pyplot as plt
+import numpy as np
 
 class Plotter:
 
@@ -57,3 +60,110 @@ class Plotter:
           self.x[:] = []
           self.y[:] = []
           self.z[:] = []
+
+
+class LivePlotter:
+    """
+    Live view of all EEG channels stacked, redrawn at a fixed frame rate whatever the sample rate.
+    Samples go into preallocated arrays swept like an oscilloscope, and only the line artists are
+    redrawn (blitting), so a redraw costs the same at any point of the session.
+    Each channel is centred and scaled in the data, the axes never change, so autoscaling
+    does not trigger a relayout.
+    """
+
+    def __init__(self, n_channels=8, fs=250.0, window_seconds=5, fps=30):
+        plt.ion()
+
+        self.n_channels = n_channels
+        self.n_samples = int(window_seconds * fs)
+        self.frame_interval = 1.0 / fps
+        self.data = np.full((self.n_samples, n_channels), np.nan)
+        self.pos = 0  # where the next sample goes
+        self.gap = max(1, self.n_samples // 50)  # blank samples ahead of the sweep
+        self.scales = np.ones(n_channels)
+        self.last_draw = 0.0
+
+        self.fig = plt.figure()
+        self.ax = self.fig.add_subplot(111)
+        x = np.arange(self.n_samples) / fs
+        self.lines = [self.ax.plot(x, self.data[:, c], linewidth=0.8, animated=True)[0]
+                      for c in range(n_channels)]
+        self.ax.set_xlim(0, window_seconds)
+        self.ax.set_ylim(-1, n_channels)
+        self.ax.set_yticks(range(n_channels))
+        self.ax.set_yticklabels(['EEG %d' % (n_channels - c) for c in range(n_channels)])
+        self.ax.set_xlabel('s')
+
+        self.background = None
+        self.fig.canvas.mpl_connect('draw_event', self._on_draw)
+        self.fig.canvas.draw()
+        plt.pause(0.001)
+
+    def _on_draw(self, event):
+        # full redraws (first show, resize) invalidate the saved background
+        self.background = self.fig.canvas.copy_from_bbox(self.ax.bbox)
+
+    def close(self):
+        plt.close(self.fig)
+
+    def push(self, channel_data):
+        """Add one sample (n_channels,) or a block (n_samples, n_channels); redraws if a frame is due."""
+        block = np.atleast_2d(channel_data)[-self.n_samples:]
+        n = len(block)
+        first = min(n, self.n_samples - self.pos)
+        self.data[self.pos:self.pos + first] = block[:first]
+        self.data[:n - first] = block[first:]
+        self.pos = (self.pos + n) % self.n_samples
+
+        now = time.perf_counter()
+        if now - self.last_draw >= self.frame_interval:
+            self.last_draw = now
+            self.draw()
+
+    def sample_callback(self):
+        """start_streaming callback."""
+        return lambda sample: self.push(sample.channel_data)
+
+    def block_callback(self):
+        """start_block_streaming callback."""
+        def call(channel_data, aux_data, ids, timestamps):
+            self.push(channel_data)
+        return call
+
+    def draw(self):
+        if self.background is None:
+            return
+        shown = self.data.copy()
+        gap = (self.pos + np.arange(self.gap)) % self.n_samples
+        shown[gap] = np.nan
+
+        # centre each channel and keep about +-3 std within its lane, smoothing the changes
+        centre = np.nanmean(shown, axis=0)
+        spread = 6 * np.nanstd(shown, axis=0)
+        spread[~(spread > 0)] = 1.0
+        self.scales = 0.8 * self.scales + 0.2 * spread
+        stacked = (shown - centre) / self.scales + (self.n_channels - 1 - np.arange(self.n_channels))
+
+        canvas = self.fig.canvas
+        canvas.restore_region(self.background)
+        for c, line in enumerate(self.lines):
+            line.set_ydata(stacked[:, c])
+            self.ax.draw_artist(line)
+        canvas.blit(self.ax.bbox)
+        canvas.flush_events()
+
+    def follow(self, ring, duration=None):
+        """
+        Show the samples written to a SampleRingBuffer (see OpenBCIBoard.start_acquisition), drawing
+        at the frame rate from this thread while the reader thread keeps acquiring.
+        """
+        cursor = ring.oldest()
+        start = time.perf_counter()
+        while duration is None or time.perf_counter() - start < duration:
+            if not plt.fignum_exists(self.fig.number):
+                break
+            block = ring.read_since(cursor, max_samples=self.n_samples)
+            cursor = block.cursor
+            if len(block.eeg):
+                self.push(block.eeg)
+            time.sleep(max(0.0, self.frame_interval - (time.perf_counter() - self.last_draw)))
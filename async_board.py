@@ -0,0 +1,174 @@
+"""
+asyncio interface to OpenBCIBoard. The serial port is read by the board's block stream loop on
+a dedicated I/O thread, and the decoded blocks are handed to the event loop with
+loop.call_soon_threadsafe, so the loop never blocks on the port or on the board's sleeps.
+EXAMPLE USE:
+async with AsyncOpenBCIBoard(port='/dev/ttyUSB0') as board:
+    await board.test_signal(1)
+    async for block in board.stream(block_size=25):
+        print(block.channel_data.mean(axis=0))
+"""
+import asyncio
+import functools
+import threading
+import timeit
+
+from open_bci_v3 import OpenBCIBoard, SampleBatch, read_until
+
+
+class AsyncOpenBCIBoard(object):
+    """
+    Args:
+      queue_size: blocks waiting for the consumer at most. When the consumer falls behind, the I/O
+          thread waits for room instead of reading more, so the backlog stays bounded.
+      board_args: OpenBCIBoard arguments; fast_connect is on by default.
+    """
+
+    def __init__(self, queue_size=64, **board_args):
+        board_args.setdefault('fast_connect', True)
+        self.board_args = board_args
+        self.queue_size = queue_size
+        self.board = None
+        self._loop = None
+        self._queue = None
+        self._credits = None
+        self._io_thread = None
+
+    async def connect(self):
+        self._loop = asyncio.get_running_loop()
+        self.board = await self._run(functools.partial(OpenBCIBoard, **self.board_args))
+        return self
+
+    async def disconnect(self):
+        await self.stop_streaming()
+        if self.board is not None:
+            await self._run(self.board.disconnect)
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc):
+        await self.disconnect()
+
+    @property
+    def streaming(self):
+        return self._io_thread is not None and self._io_thread.is_alive()
+
+    def _run(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    """
+        STREAMING
+    """
+
+    def start_streaming(self, block_size=None, max_latency=0.1):
+        """Start the I/O thread; stream() does it on its own."""
+        if self.streaming:
+            return
+        self._queue = asyncio.Queue()
+        self._credits = threading.Semaphore(self.queue_size)
+        self._io_thread = threading.Thread(target=self._io_loop, args=(block_size, max_latency), daemon=True)
+        self._io_thread.start()
+
+    def _io_loop(self, block_size, max_latency):
+        try:
+            self.board.start_block_streaming(self._on_block, block_size=block_size, max_latency=max_latency)
+        finally:
+            # tells stream() that no more blocks will come
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, None)
+
+    def _on_block(self, channel_data, aux_data, ids, timestamps):
+        # runs on the I/O thread; waits for room in the queue while streaming
+        while not self._credits.acquire(timeout=0.1):
+            if not self.board.streaming:
+                return
+            # the port is not read meanwhile, which the supervisor must not take for a stall
+            self.board.last_data_time = timeit.default_timer()
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, SampleBatch(ids, channel_data, aux_data, timestamps))
+
+    async def stream(self, block_size=None, max_latency=0.1):
+        """
+        Async iterator over the decoded blocks, as open_bci_v3.SampleBatch. Leaving the loop
+        stops streaming.
+        Args:
+          block_size: samples per block, None to yield every block as it comes from the port.
+          max_latency: seconds; yield a smaller block if its oldest sample has waited this long.
+        """
+        self.start_streaming(block_size, max_latency)
+        queue = self._queue
+        try:
+            while True:
+                block = await queue.get()
+                if block is None:
+                    return
+                self._credits.release()
+                yield block
+        finally:
+            await self.stop_streaming()
+
+    async def stop_streaming(self):
+        thread, self._io_thread = self._io_thread, None
+        if thread is None or not thread.is_alive():
+            return
+        self.board.stop()
+        if self.board.ser.is_open:
+            self.board.ser.cancel_read()
+        await self._run(thread.join)
+
+    """
+        COMMANDS
+        Run on the default executor, so their writes and sleeps don't block the event loop.
+    """
+
+    async def call(self, method, *args):
+        """Run any OpenBCIBoard method by name, e.g. await board.call('enable_filters')."""
+        return await self._run(getattr(self.board, method), *args)
+
+    async def set_channel(self, channel, toggle_position):
+        await self._run(self.board.set_channel, channel, toggle_position)
+
+    async def test_signal(self, signal):
+        await self._run(self.board.test_signal, signal)
+
+    async def impeadance_measurment(self, channel, p, n, timeout=None):
+        """
+        Returns:
+          The board's reply; while streaming it comes mixed with the data, so None is returned.
+        """
+        command = ('z' + str(channel) + str(p) + str(n) + 'Z').encode('cp1250')
+        await self._run(self.board.ser.write, command)
+        if self.streaming:
+            return None
+        timeout = self.board.handshake_timeout if timeout is None else timeout
+        reply = await self._run(read_until, self.board.ser, b'$$$', timeout)
+        return reply.decode('utf-8', 'replace')
+
+
+if __name__ == "__main__":
+    from cyton_emulator import CytonEmulator
+
+    async def main(port):
+        async with AsyncOpenBCIBoard(port=port, log=False) as board:
+            await board.test_signal(3)
+            ticks = [0]
+
+            async def heartbeat():
+                # other tasks keep running while streaming
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks[0] += 1
+
+            beat = asyncio.create_task(heartbeat())
+            samples = 0
+            start = timeit.default_timer()
+            async for block in board.stream(block_size=25):
+                samples += len(block)
+                if timeit.default_timer() - start > 3:
+                    break
+            elapsed = timeit.default_timer() - start
+            beat.cancel()
+            print("%d samples in %.2f s (%.0f samples/s) in blocks of 25; heartbeat ran %d times"
+                  % (samples, elapsed, samples / elapsed, ticks[0]))
+
+    with CytonEmulator(sample_rate=250.0 * 4) as emulator:
+        asyncio.run(main(emulator.port))
@@ -0,0 +1,289 @@
+"""
+Headless batch analysis of the recordings written by readsignal.py (<numexp>_<EC|EO>_<patient>_raw.csv)
+and of binary recordings (.obci), in a pool of processes. Each file is bandpass and notch filtered
+(zero phase), its Welch PSD gives the power of every EEG band and the peak alpha frequency, and
+everything goes to one summary CSV, optionally with a PNG per file rendered with Agg.
+Results are cached next to each recording (<file>.analysis.json) with the file's size and mtime and
+the settings used, so a rerun only processes new or changed files.
+EXAMPLE USE:
+python batch_analysis.py recordings/ -o summary.csv --png plots/
+python batch_analysis.py "recordings/*_EC_*_raw.csv" --jobs 8
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import timeit
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from scipy.integrate import trapezoid
+from scipy.signal import sosfiltfilt, welch
+
+from csv_loader import load_signal
+from filters import EEG_BANDS, bandpass_sos, notch_sos
+from open_bci_v3 import SAMPLE_RATE
+from recording import Recording, RECORDING_EXTENSION
+
+RECORDING_PATTERNS = ('*.csv', '*' + RECORDING_EXTENSION)
+CACHE_SUFFIX = '.analysis.json'
+NAME_RE = re.compile(r'^(?P<numexp>[^_]+)_(?P<condition>EC|EO)_(?P<patient>.+?)(_raw)?$')
+ALPHA = EEG_BANDS['alpha']
+
+DEFAULT_SETTINGS = {
+    'fs': SAMPLE_RATE,
+    'lowcut': 0.5,
+    'highcut': 45.0,
+    'order': 4,
+    'notch': 50.0,  # Hz, None for no notch
+    'nperseg_seconds': 4.0,
+    'channel': 2,  # channel of .obci recordings, channel_data[2] as plot_filter.py
+}
+
+
+def parse_name(filename):
+    """numexp, condition (EC/EO) and patient from a readsignal.py file name, None for each part that doesn't match."""
+    stem = os.path.basename(filename).split('.')[0]
+    match = NAME_RE.match(stem)
+    if match is None:
+        return {'numexp': None, 'condition': None, 'patient': None}
+    return {name: match.group(name) for name in ('numexp', 'condition', 'patient')}
+
+
+def is_recording(filename):
+    """Whether filename is a .obci recording or a CSV named as readsignal.py names them."""
+    if filename.endswith(RECORDING_EXTENSION):
+        return True
+    return filename.endswith('.csv') and parse_name(filename)['condition'] is not None
+
+
+def find_recordings(inputs, exclude=()):
+    """
+    Recordings in the given files, directories and glob patterns, sorted and without duplicates.
+    Files named explicitly are always taken; from directories only the ones is_recording accepts,
+    so summaries and other CSV files there are left out.
+    Args:
+      exclude: files never taken, e.g. the summary being written.
+    """
+    found = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            for pattern in RECORDING_PATTERNS:
+                found.update(path for path in glob.glob(os.path.join(item, pattern)) if is_recording(path))
+        elif os.path.isfile(item):
+            found.add(item)
+        else:
+            found.update(path for path in glob.glob(item) if path.endswith(('.csv', RECORDING_EXTENSION)))
+    exclude = {os.path.abspath(path) for path in exclude}
+    return sorted(path for path in {os.path.abspath(path) for path in found} if path not in exclude)
+
+
+def _signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime]
+
+
+def read_cache(filename, settings):
+    """Cached summary row of filename, or None if there is none or the file or settings changed."""
+    try:
+        with open(filename + CACHE_SUFFIX) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get('source') != _signature(filename) or cached.get('settings') != settings:
+        return None
+    if settings.get('png_dir') and not os.path.exists(cached['row'].get('png') or ''):
+        return None
+    return cached['row']
+
+
+def write_cache(filename, settings, row):
+    try:
+        with open(filename + CACHE_SUFFIX, 'w') as f:
+            json.dump({'source': _signature(filename), 'settings': settings, 'row': row}, f)
+    except OSError:
+        pass  # read only directory, the file will just be analyzed again
+
+
+def load_recording(filename, settings):
+    """Signal and sampling frequency of a CSV or .obci recording."""
+    if filename.endswith(RECORDING_EXTENSION):
+        recording = Recording(filename)
+        return recording.eeg(channels=settings['channel']), recording.sample_rate
+    _, values, _ = load_signal(filename, settings['fs'])
+    return values, settings['fs']
+
+
+def band_powers(freqs, psd, bands=None):
+    """Power in each band (PSD integrated over the band), dict of name -> uV^2."""
+    bands = EEG_BANDS if bands is None else bands
+    powers = {}
+    for name, (low, high) in bands.items():
+        inside = (freqs >= low) & (freqs <= high)
+        powers[name] = float(trapezoid(psd[inside], freqs[inside])) if inside.sum() > 1 else 0.0
+    return powers
+
+
+def peak_frequency(freqs, psd, band=ALPHA):
+    """Frequency of the highest PSD value in band, refined with a parabola through its neighbours."""
+    inside = np.flatnonzero((freqs >= band[0]) & (freqs <= band[1]))
+    if not len(inside):
+        return float('nan')
+    k = inside[np.argmax(psd[inside])]
+    if 0 < k < len(psd) - 1:
+        left, centre, right = psd[k - 1], psd[k], psd[k + 1]
+        denominator = left - 2 * centre + right
+        if denominator:
+            return float(freqs[k] + 0.5 * (left - right) / denominator * (freqs[1] - freqs[0]))
+    return float(freqs[k])
+
+
+def analyze_file(filename, settings):
+    """
+    Filter and analyze one recording; runs in the worker processes.
+    Returns:
+      dict with the summary row of the file; an 'error' entry if it couldn't be analyzed.
+    """
+    row = {'file': filename}
+    row.update(parse_name(filename))
+    try:
+        values, fs = load_recording(filename, settings)
+        values = np.asarray(values, dtype=float)
+        row['samples'] = len(values)
+        row['duration'] = len(values) / fs
+
+        sos = bandpass_sos(settings['lowcut'], settings['highcut'], fs, settings['order'])
+        if settings['notch']:
+            sos = np.vstack((sos, notch_sos(settings['notch'], fs=fs)))
+        filtered = sosfiltfilt(sos, values)
+
+        nperseg = min(len(filtered), int(settings['nperseg_seconds'] * fs))
+        freqs, psd = welch(filtered, fs, nperseg=nperseg)
+        powers = band_powers(freqs, psd)
+        total = sum(powers.values())
+        for name, power in powers.items():
+            row[name] = power
+        for name, power in powers.items():
+            row[name + '_rel'] = power / total if total else float('nan')
+        row['peak_alpha'] = peak_frequency(freqs, psd)
+
+        if settings.get('png_dir'):
+            row['png'] = save_png(filename, filtered, fs, freqs, psd, row, settings)
+    except Exception as e:
+        row['error'] = '%s: %s' % (type(e).__name__, e)
+    return row
+
+
+def save_png(filename, filtered, fs, freqs, psd, row, settings):
+    """Filtered signal and PSD with the bands marked, rendered off screen."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from lod_plot import MinMaxPyramid
+
+    os.makedirs(settings['png_dir'], exist_ok=True)
+    path = os.path.join(settings['png_dir'], os.path.basename(filename) + '.png')
+
+    fig, (ax_signal, ax_psd) = plt.subplots(2, 1, figsize=(12, 8))
+    # ~2 points per pixel column are enough, even for hours of signal
+    index, values = MinMaxPyramid(filtered).query(filtered, 0, len(filtered), 2400)
+    ax_signal.plot(index / fs, values, 'b-', linewidth=0.5)
+    ax_signal.set_xlabel("Time (s)")
+    ax_signal.set_ylabel("Amplitude (uV)")
+    ax_signal.set_title("%s, %.1f-%.1f Hz" % (os.path.basename(filename), settings['lowcut'], settings['highcut']))
+    ax_signal.grid()
+
+    ax_psd.semilogy(freqs, psd, 'r-')
+    for name, (low, high) in EEG_BANDS.items():
+        ax_psd.axvspan(low, high, alpha=0.1, color='C%d' % list(EEG_BANDS).index(name), label=name)
+    ax_psd.axvline(row['peak_alpha'], color='k', linestyle='--', label="PAF %.2f Hz" % row['peak_alpha'])
+    ax_psd.set_xlim(0, EEG_BANDS['gamma'][1] + 5)
+    # the notch and the bandpass edges would stretch the scale by orders of magnitude
+    passband = psd[(freqs >= settings['lowcut']) & (freqs <= settings['highcut'])]
+    if len(passband) and passband.min() > 0:
+        ax_psd.set_ylim(passband.min() / 2, passband.max() * 2)
+    ax_psd.set_xlabel("Frequency (Hz)")
+    ax_psd.set_ylabel("PSD (uV^2/Hz)")
+    ax_psd.legend(loc='upper right')
+    ax_psd.grid()
+
+    fig.tight_layout()
+    fig.savefig(path, dpi=100)
+    plt.close(fig)
+    return path
+
+
+def run(filenames, settings, jobs=None, force=False, progress=True):
+    """
+    Analyze filenames, the stale ones in a pool of jobs processes (os.cpu_count() by default).
+    Returns:
+      pandas.DataFrame with one row per file, and the number of files actually analyzed.
+    """
+    rows = {}
+    pending = []
+    for filename in filenames:
+        row = None if force else read_cache(filename, settings)
+        if row is None:
+            pending.append(filename)
+        else:
+            rows[filename] = row
+
+    if pending:
+        jobs = min(jobs or os.cpu_count() or 1, len(pending))
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(analyze_file, filename, settings): filename for filename in pending}
+            for done, future in enumerate(as_completed(futures), 1):
+                filename = futures[future]
+                row = future.result()
+                rows[filename] = row
+                if 'error' not in row:
+                    write_cache(filename, settings, row)
+                if progress:
+                    sys.stderr.write("\r%d/%d analyzed" % (done, len(pending)))
+        if progress:
+            sys.stderr.write("\n")
+
+    table = pd.DataFrame([rows[filename] for filename in filenames])
+    if len(table):
+        table = table.sort_values(['patient', 'numexp', 'condition', 'file'], na_position='last')
+    return table, len(pending)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Band powers and peak alpha frequency of many recordings.")
+    parser.add_argument('inputs', nargs='+', help="recordings, directories or glob patterns")
+    parser.add_argument('-o', '--output', default='summary.csv', help="summary table")
+    parser.add_argument('--png', metavar='DIR', help="save a plot of each recording in DIR")
+    parser.add_argument('-j', '--jobs', type=int, help="worker processes, one per core by default")
+    parser.add_argument('--force', action='store_true', help="ignore the cached results")
+    parser.add_argument('--fs', type=float, default=DEFAULT_SETTINGS['fs'], help="sampling frequency of the CSV files")
+    parser.add_argument('--band', type=float, nargs=2, default=(DEFAULT_SETTINGS['lowcut'], DEFAULT_SETTINGS['highcut']),
+                        metavar=('LOW', 'HIGH'), help="bandpass applied before the analysis, Hz")
+    parser.add_argument('--notch', type=float, default=DEFAULT_SETTINGS['notch'], help="mains frequency, 0 for no notch")
+    parser.add_argument('--channel', type=int, default=DEFAULT_SETTINGS['channel'], help="channel of .obci recordings")
+    args = parser.parse_args(argv)
+
+    settings = dict(DEFAULT_SETTINGS, fs=args.fs, lowcut=args.band[0], highcut=args.band[1],
+                    notch=args.notch or None, channel=args.channel,
+                    png_dir=os.path.abspath(args.png) if args.png else None)
+    filenames = find_recordings(args.inputs, exclude=[args.output])
+    if not filenames:
+        parser.error("no recordings found in %s" % ' '.join(args.inputs))
+
+    start = timeit.default_timer()
+    table, analyzed = run(filenames, settings, args.jobs, args.force)
+    elapsed = timeit.default_timer() - start
+    table.to_csv(args.output, index=False)
+
+    print("%d recordings, %d analyzed and %d from cache in %.1f s -> %s"
+          % (len(filenames), analyzed, len(filenames) - analyzed, elapsed, args.output))
+    if 'error' in table:
+        for _, row in table[table['error'].notna()].iterrows():
+            print("  %s: %s" % (row['file'], row['error']))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Vectorized loader for the CSV recordings written by readsignal.py, test_openbci.py and Recorder:
+  Repetition,Sample Value,FPS[,...]
+  Repetition,Sample Value Filtered,FPS[,...]
+and the files readsignal.py wrote without a header row (Repetition, Sample Value, FPS by position),
+including the old files where the values were written as "[x]" NumPy arrays.
+EXAMPLE USE:
+repetitions, values, tiempos = load_signal('01_EC_pedro_raw.csv')
+for chunk in iter_csv('long_session.csv', chunk_rows=10 ** 6):
+    process(chunk['Sample Value'])
+"""
+import argparse
+import csv
+import os
+import tempfile
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from open_bci_v3 import SAMPLE_RATE
+
+VALUE_COLUMNS = ('Sample Value', 'Sample Value Filtered')
+# columns of the files without a header, in the order Recorder writes them
+HEADERLESS_COLUMNS = ('Repetition', 'Sample Value', 'FPS', 'ID', 'Timestamp')
+
+
+class _BracketStripper(object):
+    """File wrapper dropping the brackets around values written as NumPy arrays."""
+
+    def __init__(self, f):
+        self.f = f
+
+    def read(self, size=-1):
+        return self.f.read(size).translate(None, b'[]')
+
+    def __iter__(self):
+        return (line.translate(None, b'[]') for line in self.f)
+
+
+def _has_brackets(filename):
+    with open(filename, 'rb') as f:
+        f.readline()
+        return b'[' in f.readline()
+
+
+def _headerless_columns(filename):
+    """Column names of a file without a header row, None if its first line is a header."""
+    with open(filename, 'rb') as f:
+        fields = f.readline().translate(None, b'[]').split(b',')
+    try:
+        float(fields[0])
+    except ValueError:
+        return None
+    return list(HEADERLESS_COLUMNS[:len(fields)])
+
+
+def iter_csv(filename, chunk_rows=10 ** 6, skip_negative=True):
+    """
+    Read a recording chunk by chunk, so files larger than memory can be processed.
+    Args:
+      chunk_rows: rows per chunk.
+      skip_negative: drop the rows with a negative Repetition, recorded while the signal stabilized.
+    Yields:
+      dict of column name -> float array.
+    """
+    names = _headerless_columns(filename)
+    # without a header the first row is skipped all the same, as the row by row reader always did
+    options = {} if names is None else {'header': None, 'names': names, 'skiprows': 1}
+    with open(filename, 'rb') as f:
+        source = _BracketStripper(f) if _has_brackets(filename) else f
+        for chunk in pd.read_csv(source, chunksize=chunk_rows, dtype=np.float64, engine='c', **options):
+            if skip_negative and 'Repetition' in chunk:
+                chunk = chunk[chunk['Repetition'].to_numpy() >= 0]
+            yield {name: chunk[name].to_numpy() for name in chunk.columns}
+
+
+def load_csv(filename, skip_negative=True, chunk_rows=10 ** 6):
+    """Whole recording as a dict of column name -> float array."""
+    chunks = list(iter_csv(filename, chunk_rows, skip_negative))
+    if len(chunks) == 1:
+        return chunks[0]
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+
+
+def value_column(columns):
+    """Name of the signal column of a recording, 'Sample Value' or 'Sample Value Filtered'."""
+    for name in VALUE_COLUMNS:
+        if name in columns:
+            return name
+    raise KeyError("No signal column, expected one of %s" % (VALUE_COLUMNS,))
+
+
+def load_signal(filename, fs=SAMPLE_RATE, skip_negative=True):
+    """
+    Returns:
+      repetitions, sample values and times (repetition / fs) as arrays.
+    """
+    data = load_csv(filename, skip_negative)
+    repetitions = data['Repetition'].astype(np.int64)
+    return repetitions, data[value_column(data)], repetitions / fs
+
+
+def _load_signal_rows(filename):
+    # Row by row parsing plot_filter.py used before, kept for the benchmark
+    repetitions, sample_values, tiempos, fps_values = [], [], [], []
+    with open(filename) as csvfile:
+        reader = csv.reader(csvfile, delimiter=',')
+        next(reader)
+        for row in reader:
+            if int(row[0]) < 0:
+                continue
+            repetitions.append(int(row[0]))
+            sample_values.append(float(row[1].strip('[]')))
+            fps_values.append(float(row[2]))
+            tiempos.append(float(row[0]) / SAMPLE_RATE)
+    return repetitions, sample_values, tiempos
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark CSV loading on samples_test/sample.csv scaled up.")
+    parser.add_argument('--rows', type=int, default=10 ** 7)
+    parser.add_argument('--brackets', action='store_true', help="write the values as [x], like test_openbci.py")
+    args = parser.parse_args()
+
+    sample = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'samples_test', 'sample.csv')
+    source = pd.read_csv(sample)
+    reps = -(-args.rows // len(source))
+    values = np.tile(source['Sample Value'].to_numpy(), reps)[:args.rows]
+    fps = np.tile(source['FPS'].to_numpy(), reps)[:args.rows]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'scaled.csv')
+        value_fmt = '[%r]' if args.brackets else '%r'
+        with open(filename, 'w') as f:
+            f.write('Repetition,Sample Value,FPS\n')
+            step = 10 ** 6
+            for i in range(0, args.rows, step):
+                f.writelines('%d,%s,%r\n' % (r, value_fmt % v, p) for r, v, p in
+                             zip(range(i, i + step), values[i:i + step].tolist(), fps[i:i + step].tolist()))
+        print("%d rows, %.0f MB" % (args.rows, os.path.getsize(filename) / 1e6))
+
+        start = timeit.default_timer()
+        repetitions, sample_values, tiempos = load_signal(filename)
+        elapsed = timeit.default_timer() - start
+        print("load_signal: %.2f s (%.1f M rows/s)" % (elapsed, args.rows / elapsed / 1e6))
+
+        start = timeit.default_timer()
+        chunks = sum(1 for _ in iter_csv(filename, chunk_rows=10 ** 6))
+        elapsed = timeit.default_timer() - start
+        print("iter_csv, %d chunks of 10^6 rows: %.2f s" % (chunks, elapsed))
+
+        start = timeit.default_timer()
+        old = _load_signal_rows(filename)
+        elapsed = timeit.default_timer() - start
+        print("csv.reader row by row: %.2f s (%.1f M rows/s)" % (elapsed, args.rows / elapsed / 1e6))
+        assert np.allclose(old[1], sample_values)
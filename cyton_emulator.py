@@ -0,0 +1,413 @@
+"""
+Emulated Cyton board + dongle for load testing and benchmarking without hardware.
+The emulator opens a pseudo terminal and answers the board commands on it, so
+OpenBCIBoard can connect through its normal port argument:
+EXAMPLE USE:
+emulator = CytonEmulator(sample_rate=250 * 10)
+emulator.start()
+board = OpenBCIBoard(port=emulator.port)
+...
+emulator.close()
+@NOTE: Needs a POSIX pty, it won't run on Windows.
+"""
+import argparse
+import os
+import select
+import threading
+import time
+import timeit
+import tty
+
+import numpy as np
+
+from open_bci_v3 import (START_BYTE, END_BYTE, PACKET_SIZE, EEG_CHANNELS_PER_PACKET, AUX_CHANNELS_PER_PACKET,
+                         scale_fac_uVolts_per_count, scale_fac_accel_G_per_count)
+
+FIRMWARE_BANNER = ("OpenBCI V3 8-16 channel\n"
+                   "On Board ADS1299 Device ID: 0x3E\n"
+                   "LIS3DH Device ID: 0x33\n"
+                   "Firmware: v3.1.2\n"
+                   "$$$")
+
+REGISTER_SETTINGS = ("\nBoard ADS Registers\n"
+                     "ADS_ID, 00, 3E, 0, 0, 1, 1, 1, 1, 1, 0\n"
+                     "CONFIG1, 01, 96, 1, 0, 0, 1, 0, 1, 1, 0\n"
+                     "CONFIG2, 02, C0, 1, 1, 0, 0, 0, 0, 0, 0\n"
+                     "CONFIG3, 03, EC, 1, 1, 1, 0, 1, 1, 0, 0\n"
+                     "LOFF, 04, 02, 0, 0, 0, 0, 0, 0, 1, 0\n"
+                     + "".join("CH%dSET, %02X, 68, 0, 1, 1, 0, 1, 0, 0, 0\n" % (c + 1, c + 5)
+                               for c in range(EEG_CHANNELS_PER_PACKET)) +
+                     "BIAS_SENSP, 0D, FF, 1, 1, 1, 1, 1, 1, 1, 1\n"
+                     "BIAS_SENSN, 0E, FF, 1, 1, 1, 1, 1, 1, 1, 1\n"
+                     "MISC1, 15, 20, 0, 0, 1, 0, 0, 0, 0, 0\n"
+                     "CONFIG4, 17, 00, 0, 0, 0, 0, 0, 0, 0, 0\n"
+                     "$$$")
+
+BAUD_CODES = {0x05: 115200, 0x06: 230400, 0x0A: 921600}
+
+
+def encode_packets(ids, channel_counts, aux_counts):
+    """
+    Build the raw bytes of N packets at once, the inverse of open_bci_v3.decode_packets.
+    Args:
+      ids: (N,) packet ids, taken modulo 256.
+      channel_counts: (N, 8) 24 bit signed counts.
+      aux_counts: (N, 3) 16 bit signed counts.
+    """
+    n = len(ids)
+    packets = np.empty((n, PACKET_SIZE), dtype=np.uint8)
+    packets[:, 0] = START_BYTE
+    packets[:, 1] = np.asarray(ids) % 256
+
+    counts = np.asarray(channel_counts, dtype=np.int64) & 0xFFFFFF
+    channels = packets[:, 2:2 + 3 * EEG_CHANNELS_PER_PACKET].reshape(n, EEG_CHANNELS_PER_PACKET, 3)
+    channels[..., 0] = counts >> 16
+    channels[..., 1] = (counts >> 8) & 0xFF
+    channels[..., 2] = counts & 0xFF
+
+    aux = np.asarray(aux_counts, dtype='>i2').view(np.uint8).reshape(n, 2 * AUX_CHANNELS_PER_PACKET)
+    packets[:, 2 + 3 * EEG_CHANNELS_PER_PACKET:PACKET_SIZE - 1] = aux
+    packets[:, PACKET_SIZE - 1] = END_BYTE
+    return packets
+
+
+class CytonEmulator(object):
+    """
+    Fake Cyton board behind a pseudo terminal.
+    Args:
+      sample_rate: packets per second while streaming, None streams as fast as the reader takes them.
+      radio_channel: radio channel of the board.
+      host_channel: radio channel the dongle starts on, radio_channel by default. Data and
+          replies only get through while both are on the same channel.
+      reply_noise: probability of a reply to a dongle command arriving with junk bytes in front.
+      corrupt_prob: probability of a packet getting one corrupted byte.
+      drop_prob: probability of a packet being lost (its id is skipped).
+      stall_every: seconds of streaming between stalls, None for no stalls.
+      stall_duration: seconds the board stays silent on each stall.
+      seed: seed of the random generator used for the signal and the faults.
+    """
+
+    def __init__(self, sample_rate=250.0, radio_channel=7, host_channel=None, reply_noise=0.0, corrupt_prob=0.0,
+                 drop_prob=0.0, stall_every=None, stall_duration=1.0, seed=None):
+        self.sample_rate = sample_rate
+        self.radio_channel = radio_channel
+        self.host_channel = radio_channel if host_channel is None else host_channel
+        self.reply_noise = reply_noise
+        self.corrupt_prob = corrupt_prob
+        self.drop_prob = drop_prob
+        self.stall_every = stall_every
+        self.stall_duration = stall_duration
+        self.rng = np.random.default_rng(seed)
+
+        self.port = None
+        self.streaming = False
+        self.running = False
+        self.packets_sent = 0
+        self.packets_dropped = 0
+        self.packets_corrupted = 0
+        self.packets_stalled = 0
+        self.commands = []  # every command received, for inspection
+        self._master = None
+        self._slave = None
+        self._write_lock = threading.Lock()
+        self._threads = []
+        self._stream_started = threading.Event()
+        self._sample_counter = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def start(self):
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)
+        self.port = os.ttyname(self._slave)
+        self.running = True
+        self._threads = [threading.Thread(target=self._command_loop, daemon=True),
+                         threading.Thread(target=self._stream_loop, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        return self.port
+
+    def close(self):
+        self.running = False
+        self.streaming = False
+        self._stream_started.set()
+        for thread in self._threads:
+            thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    """
+        COMMANDS
+    """
+
+    def _command_loop(self):
+        pending = bytearray()
+        while self.running:
+            readable, _, _ = select.select([self._master], [], [], 0.05)
+            if not readable:
+                continue
+            try:
+                pending += os.read(self._master, 1024)
+            except (BlockingIOError, OSError):
+                continue
+            while pending:
+                used = self._handle_command(pending)
+                if used == 0:
+                    break  # incomplete multi byte command, wait for the rest
+                del pending[:used]
+
+    def _handle_command(self, pending):
+        """Act on the command at the start of pending and return how many bytes it used."""
+        c = pending[0]
+        if c == 0xF0:
+            if len(pending) < 2:
+                return 0
+            sub = pending[1]
+            if sub in (0x01, 0x02):
+                if len(pending) < 3:
+                    return 0
+                self.commands.append(bytes(pending[:3]))
+                if sub == 0x01:
+                    if not self.linked:
+                        self._dongle_reply("Failure: Verify that your board is on and has a clear path$$$")
+                        return 3
+                    self.radio_channel = pending[2]
+                    self.host_channel = pending[2]
+                    self._dongle_reply("Success: Channel set to %d$$$" % pending[2])
+                else:
+                    self.host_channel = pending[2]
+                    self._dongle_reply("Success: Host override - Channel number: %d$$$" % pending[2])
+                return 3
+            self.commands.append(bytes(pending[:2]))
+            if sub == 0x00:
+                if self.linked:
+                    self._dongle_reply("Success: Host and Device on Channel Number: %d$$$" % self.radio_channel)
+                else:
+                    self._dongle_reply("Failure: Host on Channel Number: %d$$$" % self.host_channel)
+            elif sub == 0x07:
+                self._dongle_reply("Success: System is Up$$$" if self.linked else "Failure: System is Down$$$")
+            elif sub in BAUD_CODES:
+                self._reply("Success: Switch your baud rate to %d$$$" % BAUD_CODES[sub])
+            else:
+                self._reply("Failure: Unknown command$$$")
+            return 2
+        if c == ord('z'):
+            # impedance: z (CHANNEL, PCHAN, NCHAN) Z
+            if len(pending) < 5:
+                return 0
+            self.commands.append(bytes(pending[:5]))
+            return 5
+
+        self.commands.append(bytes(pending[:1]))
+        if not self.linked:
+            return 1  # the board is on another channel, the command never reaches it
+        if c == ord('v'):
+            self.streaming = False
+            self._reply(FIRMWARE_BANNER)
+        elif c == ord('?'):
+            self._reply(REGISTER_SETTINGS)
+        elif c == ord('b'):
+            self.streaming = True
+            self._stream_started.set()
+        elif c == ord('s'):
+            self.streaming = False
+        return 1
+
+    @property
+    def linked(self):
+        return self.host_channel == self.radio_channel
+
+    def _reply(self, text):
+        self._write(text.encode('utf-8'))
+
+    def _dongle_reply(self, text):
+        if self.reply_noise and self.rng.random() < self.reply_noise:
+            self._write(self.rng.integers(0, 256, self.rng.integers(1, 8)).astype(np.uint8).tobytes())
+        self._reply(text)
+
+    def _write(self, data):
+        view = memoryview(data)
+        with self._write_lock:
+            while view and self.running:
+                try:
+                    written = os.write(self._master, view)
+                    view = view[written:]
+                except BlockingIOError:
+                    select.select([], [self._master], [], 0.05)
+                except OSError:
+                    return
+
+    """
+        STREAMING
+    """
+
+    def _make_packets(self, n):
+        ids = np.arange(self._sample_counter, self._sample_counter + n)
+        t = ids / float(self.sample_rate or 250.0)
+        self._sample_counter += n
+
+        # 10 Hz alpha + 50 Hz mains + noise, in uV
+        phases = np.arange(EEG_CHANNELS_PER_PACKET) * 0.3
+        signal = (20.0 * np.sin(2 * np.pi * 10.0 * t[:, None] + phases)
+                  + 5.0 * np.sin(2 * np.pi * 50.0 * t[:, None])
+                  + self.rng.normal(0.0, 2.0, (n, EEG_CHANNELS_PER_PACKET)))
+        channel_counts = np.round(signal / scale_fac_uVolts_per_count).astype(np.int64)
+        aux_counts = np.round(np.tile([0.0, 0.0, 1.0], (n, 1)) / scale_fac_accel_G_per_count).astype(np.int64)
+        packets = encode_packets(ids, channel_counts, aux_counts)
+
+        if self.drop_prob:
+            kept = self.rng.random(n) >= self.drop_prob
+            self.packets_dropped += n - int(np.count_nonzero(kept))
+            packets = packets[kept]
+        if self.corrupt_prob and len(packets):
+            corrupted = np.flatnonzero(self.rng.random(len(packets)) < self.corrupt_prob)
+            offsets = self.rng.integers(0, PACKET_SIZE, len(corrupted))
+            packets[corrupted, offsets] ^= self.rng.integers(1, 256, len(corrupted)).astype(np.uint8)
+            self.packets_corrupted += len(corrupted)
+        return packets
+
+    def _stream_loop(self):
+        batch = 250  # packets per write when streaming as fast as possible
+        while self.running:
+            if not self.streaming:
+                self._stream_started.clear()
+                self._stream_started.wait(0.1)
+                continue
+
+            start = timeit.default_timer()
+            sent = 0
+            next_stall = start + self.stall_every if self.stall_every else None
+            while self.running and self.streaming:
+                now = timeit.default_timer()
+                if next_stall is not None and now >= next_stall:
+                    time.sleep(self.stall_duration)
+                    next_stall = timeit.default_timer() + self.stall_every
+                    if self.sample_rate:
+                        # the board keeps sampling while the link is down
+                        lost = int((timeit.default_timer() - start) * self.sample_rate) - sent
+                        self._sample_counter += lost
+                        self.packets_stalled += lost
+                        sent += lost
+                    continue
+
+                if self.sample_rate:
+                    due = int((now - start) * self.sample_rate) - sent
+                    if due <= 0:
+                        time.sleep(min(0.005, 1.0 / self.sample_rate))
+                        continue
+                else:
+                    due = batch
+                packets = self._make_packets(due)
+                sent += due
+                if not self.linked:
+                    continue  # lost over the air
+                self._write(packets.tobytes())
+                self.packets_sent += len(packets)
+
+
+def benchmark(rate, seconds, corrupt_prob, drop_prob):
+    """Connect an OpenBCIBoard to an emulator and measure how fast the parser and the callbacks keep up."""
+    from open_bci_v3 import OpenBCIBoard
+
+    with CytonEmulator(sample_rate=rate, corrupt_prob=corrupt_prob, drop_prob=drop_prob, seed=0) as emulator:
+        board = OpenBCIBoard(port=emulator.port, log=False)
+
+        board.ser.write(b'b')
+        board.streaming = True
+        received = 0
+        start = timeit.default_timer()
+        while timeit.default_timer() - start < seconds:
+            ids, channel_data, aux_data = board._read_serial_block()
+            received += len(ids)
+        elapsed = timeit.default_timer() - start
+        print("Block decoder: %d packets in %.2f s -> %.0f packets/s (%.1fx real time)"
+              % (received, elapsed, received / elapsed, received / elapsed / 250.0))
+        board.stop()
+        board.flush()
+
+        received = [0]
+
+        def count(sample):
+            received[0] += 1
+
+        start = timeit.default_timer()
+        board.start_streaming(count, lapse=seconds)
+        elapsed = timeit.default_timer() - start
+        if board.checktimer:
+            board.checktimer.cancel()
+        print("Per sample callbacks: %d samples in %.2f s -> %.0f samples/s (%.1fx real time)"
+              % (received[0], elapsed, received[0] / elapsed, received[0] / elapsed / 250.0))
+        board.flush()
+
+        received = [0]
+        stats = board.enable_parser_stats()
+        start = timeit.default_timer()
+        board.start_streaming(count, lapse=seconds)
+        elapsed = timeit.default_timer() - start
+        if board.checktimer:
+            board.checktimer.cancel()
+        board.disable_parser_stats()
+        print("Per sample callbacks with parser stats: %d samples in %.2f s -> %.0f samples/s (%.1fx real time)"
+              % (received[0], elapsed, received[0] / elapsed, received[0] / elapsed / 250.0))
+        snapshot = stats.snapshot()
+        print("  read wait %(read_wait_ms).0f ms, decode %(decode_ms).0f ms (%(decode_us_per_packet).2f us/packet), "
+              "callbacks %(callback_ms).0f ms (%(callback_us_per_packet).2f us/packet)" % snapshot)
+        print("  %(resyncs)d resyncs, %(skipped_bytes)d bytes skipped, %(bad_end_bytes)d bad end bytes, "
+              "%(id_gaps)d id gaps, %(missing_ids)d packets missing" % snapshot)
+        board.flush()
+
+        received = [0, 0]
+
+        def count_block(channel_data, aux_data, ids, timestamps):
+            received[0] += len(ids)
+            received[1] += 1
+
+        start = timeit.default_timer()
+        board.start_block_streaming(count_block, block_size=250, max_latency=0.1, lapse=seconds)
+        elapsed = timeit.default_timer() - start
+        if board.checktimer:
+            board.checktimer.cancel()
+        print("Block callbacks: %d samples in %d calls in %.2f s -> %.0f samples/s (%.1fx real time)"
+              % (received[0], received[1], elapsed, received[0] / elapsed, received[0] / elapsed / 250.0))
+        print("Emulator sent %d packets, dropped %d, corrupted %d"
+              % (emulator.packets_sent, emulator.packets_dropped, emulator.packets_corrupted))
+        board.disconnect()
+
+
+def connect_benchmark(repeats=5, legacy=True):
+    """Time OpenBCIBoard construction against an emulator, with fast_connect and with the fixed sleeps."""
+    from open_bci_v3 import OpenBCIBoard
+
+    modes = [('fast_connect', True)] + ([('fixed sleeps', False)] if legacy else [])
+    for name, fast in modes:
+        times = []
+        for _ in range(repeats if fast else 1):
+            with CytonEmulator(radio_channel=7) as emulator:
+                start = timeit.default_timer()
+                board = OpenBCIBoard(port=emulator.port, log=False, fast_connect=fast)
+                times.append(timeit.default_timer() - start)
+                assert board.radio_channel_number == 7 and board.openBCIFirmwareVersion == 'v3'
+                board.disconnect()
+        print("Connect with %s: %.1f ms (best of %d), %.1f ms mean"
+              % (name, min(times) * 1e3, len(times), np.mean(times) * 1e3))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark OpenBCIBoard against an emulated Cyton board.")
+    parser.add_argument('--rate', type=float, default=250.0 * 100,
+                        help="packets per second, 0 streams as fast as possible")
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--corrupt', type=float, default=0.0, help="probability of corrupting a packet")
+    parser.add_argument('--drop', type=float, default=0.0, help="probability of dropping a packet")
+    parser.add_argument('--connect', action='store_true', help="benchmark the connection time instead")
+    args = parser.parse_args()
+    if args.connect:
+        connect_benchmark()
+    else:
+        benchmark(args.rate or None, args.seconds, args.corrupt, args.drop)
@@ -0,0 +1,340 @@
+"""
+Streaming IIR filters for live data: the coefficients are designed once, as
+second-order sections, and the filter state carries over between samples and blocks.
+EXAMPLE USE:
+alpha = StreamingFilter(bandpass_sos(8.0, 12.0, 250.0), notch_sos(50.0, fs=250.0))
+board.start_streaming(alpha.sample_callback(handle_sample))
+Offline, filtfilt_chunked filters recordings longer than memory with zero phase:
+filtfilt_to_file(bandpass_sos(0.5, 45.0, 250.0), Recording('long.obci'), 'long_filtered.npy')
+"""
+import timeit
+from functools import lru_cache
+
+import numpy as np
+from scipy.signal import butter, iirnotch, lfilter, lfilter_zi, sosfilt, sosfilt_zi, tf2sos
+
+# Hz, gamma stops below the 50 Hz mains
+EEG_BANDS = {
+    'delta': (0.5, 4.0),
+    'theta': (4.0, 8.0),
+    'alpha': (8.0, 12.0),
+    'beta': (12.0, 30.0),
+    'gamma': (30.0, 45.0),
+}
+
+
+def bandpass_sos(lowcut, highcut, fs, order=5):
+    return butter(order, [lowcut, highcut], btype='band', fs=fs, output='sos')
+
+
+@lru_cache(maxsize=None)
+def _cached_bandpass_sos(lowcut, highcut, fs, order):
+    # shared between banks, don't modify in place
+    return bandpass_sos(lowcut, highcut, fs, order)
+
+
+def notch_sos(f0=50.0, Q=30.0, fs=250.0):
+    b, a = iirnotch(f0, Q, fs)
+    return tf2sos(b, a)
+
+
+class StreamingFilter(object):
+    """
+    Filter a stream of samples across all channels, keeping the filter state between calls.
+    Several stages (e.g. bandpass + notch) are chained into one cascade of sections,
+    so each call is a single sosfilt over every channel.
+    Args:
+      stages: one or more arrays of second-order sections, applied in order.
+      steady_state: start from the steady state for the first sample instead of from rest,
+          which avoids the start up transient caused by the DC offset of the electrodes.
+    """
+
+    def __init__(self, *stages, steady_state=True):
+        self.sos = np.vstack([np.atleast_2d(stage) for stage in stages])
+        self.steady_state = steady_state
+        self.zi = None
+
+    def reset(self):
+        self.zi = None
+
+    def process(self, data):
+        """
+        Args:
+          data: one sample of every channel (n_channels,) or a block (n_samples, n_channels).
+        Returns:
+          The filtered data, same shape as the input.
+        """
+        data = np.asarray(data, dtype=float)
+        single = data.ndim == 1
+        if single:
+            data = data[None, :]
+        if self.zi is None:
+            zi = sosfilt_zi(self.sos)[:, :, None]
+            self.zi = zi * data[0] if self.steady_state else np.zeros(zi.shape[:2] + data.shape[1:])
+        filtered, self.zi = sosfilt(self.sos, data, axis=0, zi=self.zi)
+        return filtered[0] if single else filtered
+
+    def sample_callback(self, callback):
+        """Wrap a start_streaming callback so it receives samples with filtered channel_data."""
+        def call(sample):
+            sample.channel_data = self.process(sample.channel_data).tolist()
+            sample.filtered = 1
+            callback(sample)
+        return call
+
+    def block_callback(self, callback):
+        """Wrap a start_block_streaming callback so it receives filtered channel_data."""
+        def call(channel_data, aux_data, ids, timestamps):
+            callback(self.process(channel_data), aux_data, ids, timestamps)
+        return call
+
+
+class FilterBank(object):
+    """
+    Split every channel into frequency bands, keeping the state of each band between blocks.
+    Each band is one sosfilt over all channels at once; the coefficients are designed once
+    and shared between banks with the same settings.
+    Args:
+      fs: sampling frequency.
+      bands: dict of name -> (lowcut, highcut), EEG_BANDS by default.
+      order: order of each Butterworth bandpass.
+      steady_state: start from the steady state for the first sample instead of from rest.
+    """
+
+    def __init__(self, fs, bands=None, order=4, steady_state=True):
+        self.fs = fs
+        self.bands = dict(bands if bands is not None else EEG_BANDS)
+        self.names = list(self.bands)
+        self.sos = [_cached_bandpass_sos(float(low), float(high), float(fs), order)
+                    for low, high in self.bands.values()]
+        self.steady_state = steady_state
+        self.zi = None
+
+    def reset(self):
+        self.zi = None
+
+    def process(self, data):
+        """
+        Args:
+          data: a block (n_samples, n_channels), e.g. the channel_data of start_block_streaming.
+        Returns:
+          (n_bands, n_samples, n_channels) array, bands in the order of self.names.
+        """
+        data = np.asarray(data, dtype=float)
+        if self.zi is None:
+            self.zi = []
+            for sos in self.sos:
+                zi = sosfilt_zi(sos)[:, :, None]
+                self.zi.append(zi * data[0] if self.steady_state else np.zeros(zi.shape[:2] + data.shape[1:]))
+        out = np.empty((len(self.sos),) + data.shape)
+        for band, sos in enumerate(self.sos):
+            out[band], self.zi[band] = sosfilt(sos, data, axis=0, zi=self.zi[band])
+        return out
+
+    def block_callback(self, callback):
+        """Wrap a start_block_streaming callback so it receives the (bands, samples, channels) array."""
+        def call(channel_data, aux_data, ids, timestamps):
+            callback(self.process(channel_data), aux_data, ids, timestamps)
+        return call
+
+
+"""
+    OFFLINE ZERO-PHASE FILTERING
+"""
+
+
+class _Cascade(object):
+    """sosfilt or lfilter, whichever the coefficients are for, with its steady state."""
+
+    def __init__(self, coefficients):
+        if isinstance(coefficients, tuple) and len(coefficients) == 2:
+            self.b = np.atleast_1d(coefficients[0])
+            self.a = np.atleast_1d(coefficients[1])
+            self.sos = None
+            self.zi = lfilter_zi(self.b, self.a)
+            self.zi_shape = (len(self.zi),)
+            # as scipy.signal.filtfilt
+            self.padlen = 3 * max(len(self.a), len(self.b))
+        else:
+            self.sos = np.atleast_2d(coefficients)
+            self.zi = sosfilt_zi(self.sos)
+            self.zi_shape = self.zi.shape
+            # as scipy.signal.sosfiltfilt
+            self.padlen = 3 * (2 * len(self.sos) + 1 - min((self.sos[:, 2] == 0).sum(), (self.sos[:, 5] == 0).sum()))
+
+    def initial(self, x0):
+        """State of the filter at rest at x0, (n_channels,) or a scalar."""
+        x0 = np.asarray(x0, dtype=float)
+        return self.zi.reshape(self.zi_shape + (1,) * x0.ndim) * x0
+
+    def __call__(self, data, zi):
+        if self.sos is None:
+            return lfilter(self.b, self.a, data, axis=0, zi=zi)
+        return sosfilt(self.sos, data, axis=0, zi=zi)
+
+
+def _edge_extensions(head, tail, padlen, padtype):
+    """
+    Padding before and after the signal, as scipy.signal.filtfilt builds it.
+    Args:
+      head: the first padlen + 1 samples, tail: the last padlen + 1 samples.
+    """
+    if padtype == 'odd':
+        return 2 * head[0] - head[padlen:0:-1], 2 * tail[-1] - tail[-2::-1]
+    if padtype == 'even':
+        return head[padlen:0:-1], tail[-2::-1]
+    if padtype == 'constant':
+        return np.repeat(head[:1], padlen, axis=0), np.repeat(tail[-1:], padlen, axis=0)
+    raise ValueError("padtype must be 'odd', 'even', 'constant' or None, not %r" % padtype)
+
+
+def _reader(source, channels=None):
+    """Function reading samples start:stop of source as floats."""
+    if hasattr(source, 'records') and hasattr(source, 'scale_eeg'):
+        # recording.Recording, read straight from its memmap without the seconds to samples rounding
+        def read(start, stop):
+            counts = source.records['eeg'][start:stop]
+            if channels is not None:
+                counts = counts[:, channels]
+            return counts * source.scale_eeg
+        return read
+
+    def read(start, stop):
+        data = source[start:stop] if channels is None else source[start:stop, channels]
+        return np.asarray(data, dtype=float)
+    return read
+
+
+def filtfilt_chunked(coefficients, source, dest=None, chunk_samples=250 * 60, padtype='odd', padlen=None,
+                     channels=None):
+    """
+    Zero-phase filtering of a signal too long for memory, chunk by chunk: the forward pass writes
+    to dest and the backward pass filters dest in place, from the end, so the memory used is
+    O(chunk_samples) whatever the length. The result is that of scipy.signal.sosfiltfilt, or
+    scipy.signal.filtfilt for (b, a), with the same padding.
+    Args:
+      coefficients: second-order sections, or a (b, a) tuple.
+      source: (n_samples,) or (n_samples, n_channels) array read by slices, e.g. a np.memmap,
+          or a recording.Recording (its EEG in uV).
+      dest: writable array of the shape of the output, e.g. a np.memmap opened 'w+'; may be source
+          itself to filter in place. A new array if None.
+      chunk_samples: samples read, filtered and written at a time.
+      padtype: 'odd', 'even', 'constant' or None, as scipy.signal.filtfilt.
+      padlen: samples of padding at each end, the default of scipy.signal.filtfilt/sosfiltfilt if None.
+      channels: channels of source to filter, all by default.
+    Returns:
+      dest.
+    """
+    cascade = _Cascade(coefficients)
+    read = _reader(source, channels)
+    n = len(source)
+    if padtype is None:
+        padlen = 0
+    elif padlen is None:
+        padlen = cascade.padlen
+    if n <= padlen:
+        raise ValueError("The signal must be longer than padlen=%d samples, it has %d" % (padlen, n))
+    if dest is None:
+        dest = np.empty((n,) + read(0, 1).shape[1:])
+
+    # both edges are read first, dest may be source
+    head = read(0, padlen + 1)
+    tail = read(n - padlen - 1, n)
+
+    # forward pass, starting at rest at the first sample of the padded signal
+    if padlen:
+        before, after = _edge_extensions(head, tail, padlen, padtype)
+        _, zi = cascade(before, cascade.initial(before[0]))
+    else:
+        zi = cascade.initial(head[0])
+    for start in range(0, n, chunk_samples):
+        stop = min(start + chunk_samples, n)
+        dest[start:stop], zi = cascade(read(start, stop), zi)
+
+    # backward pass, starting at rest at the last forward output
+    if padlen:
+        after, _ = cascade(after, zi)
+        _, zi = cascade(after[::-1], cascade.initial(after[-1]))
+    else:
+        zi = cascade.initial(dest[n - 1])
+    for stop in range(n, 0, -chunk_samples):
+        start = max(stop - chunk_samples, 0)
+        filtered, zi = cascade(np.asarray(dest[start:stop], dtype=float)[::-1], zi)
+        dest[start:stop] = filtered[::-1]
+
+    if isinstance(dest, np.memmap):
+        dest.flush()
+    return dest
+
+
+def filtfilt_to_file(coefficients, source, filename, chunk_samples=250 * 60, channels=None, dtype=np.float64,
+                     **kwargs):
+    """
+    filtfilt_chunked into a new .npy file, read back with np.load(filename, mmap_mode='r').
+    Args:
+      source: np.memmap, array or recording.Recording.
+    Returns:
+      The output, memory-mapped.
+    """
+    first = _reader(source, channels)(0, 1)
+    dest = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=(len(source),) + first.shape[1:])
+    return filtfilt_chunked(coefficients, source, dest, chunk_samples, channels=channels, **kwargs)
+
+
+if __name__ == "__main__":
+
+    fs = 250.0
+    n_channels = 16
+    seconds = 600
+    block = 25  # 10 blocks per second, as start_block_streaming(block_size=25) would deliver
+
+    data = np.random.default_rng(0).normal(0, 20, (int(fs * seconds), n_channels))
+    bank = FilterBank(fs)
+
+    start = timeit.default_timer()
+    for i in range(0, len(data), block):
+        bank.process(data[i:i + block])
+    elapsed = timeit.default_timer() - start
+    print("Filter bank, %d channels x %d bands, blocks of %d: %d s of signal in %.2f s (%.0fx real time)"
+          % (n_channels, len(bank.names), block, seconds, elapsed, seconds / elapsed))
+
+    bank.reset()
+    start = timeit.default_timer()
+    bank.process(data)
+    elapsed = timeit.default_timer() - start
+    print("Filter bank, whole recording at once: %d s of signal in %.2f s (%.0fx real time)"
+          % (seconds, elapsed, seconds / elapsed))
+
+    import os
+    import tempfile
+    import tracemalloc
+    from scipy.signal import sosfiltfilt
+
+    # one hour of 16 channels on disk, zero-phase bandpass + notch
+    sos = np.vstack((bandpass_sos(0.5, 45.0, fs, order=4), notch_sos(50.0, fs=fs)))
+    hours = 1
+    with tempfile.TemporaryDirectory() as tmp:
+        source = np.lib.format.open_memmap(os.path.join(tmp, 'raw.npy'), mode='w+', dtype=np.float32,
+                                           shape=(int(fs * 3600 * hours), n_channels))
+        for i in range(0, len(source), len(data)):
+            source[i:i + len(data)] = data[:len(source) - i]
+        source.flush()
+
+        tracemalloc.start()
+        start = timeit.default_timer()
+        filtered = filtfilt_to_file(sos, source, os.path.join(tmp, 'filtered.npy'), chunk_samples=int(fs * 60))
+        elapsed = timeit.default_timer() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("filtfilt_chunked, %d h x %d channels (%.0f MB) in 1 min chunks: %.2f s, peak memory %.1f MB"
+              % (hours, n_channels, source.nbytes / 1e6, elapsed, peak / 1e6))
+
+        window = slice(len(source) // 2, len(source) // 2 + int(fs * 600))
+        tracemalloc.start()
+        reference = sosfiltfilt(sos, np.asarray(source[window], dtype=float), axis=0)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        chunked = filtfilt_chunked(sos, source[window], chunk_samples=int(fs * 60))
+        print("sosfiltfilt needs %.1f MB for just 10 min; chunked vs sosfiltfilt, max difference %.1e"
+              % (peak / 1e6, np.abs(chunked - reference).max()))
+        del filtered, source
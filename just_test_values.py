@@ -4,29 +4,30 @@
 # ---------------------------------------------------------------------
 ########################################################################
 
-from Fps import Fps
+from metrics import StreamMetrics
 from open_bci_v3 import OpenBCIBoard
 from test_openbci import stop_streaming
 
 lowcut = 8.0
 highcut = 12.0
 fs = 250.0
-ffps = Fps()
-ffps.tic()
+# muestras/s, intervalos entre muestras (p50/p99/máx) y bytes/s del puerto
+metrics = StreamMetrics(expected_rate=fs)
 
 def handle_sample(sample):
 
     global repetitions
 
-    ffps.steptoc()
+    metrics.tick()
 
     sample_value = sample.channel_data[2]  # Extraer el dato relevante
-    fps_value = ffps.fps  # Calcular FPS estimado
+    fps_value = metrics.rate()  # muestras/s en la ventana
 
     print(f"Estimated FPS: {fps_value:.2f} - Sample: {sample_value} ")
 
 
 board = OpenBCIBoard()
+metrics.attach(board)
 board.print_register_settings()
 board.get_radio_channel_number()
 print(f'OpenBCI connected to radio channel {board.radio_channel_number}')
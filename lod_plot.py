@@ -0,0 +1,233 @@
+"""
+Level-of-detail plotting for long recordings: a min/max pyramid per channel is computed
+once, and on every zoom or pan only about as many points as the axes has pixels are drawn.
+EXAMPLE USE:
+fig, ax = plt.subplots()
+lod = LODPlot(ax, samples, tiempos, cache_path='01_EC_pedro_raw.obci.lod.npz')
+plt.show()
+"""
+import os
+
+import numpy as np
+
+
+class MinMaxPyramid(object):
+    """
+    Level k keeps the min and max of every bucket of factor ** k samples, for every channel.
+    Args:
+      data: (n_samples,) or (n_samples, n_channels) array-like, e.g. a np.memmap; read in chunks.
+      factor: samples per bucket of the first level, and buckets merged per level above it.
+      min_buckets: stop adding levels when a level has fewer buckets than this.
+      chunk: samples read at a time while building the first level.
+    """
+
+    def __init__(self, data, factor=4, min_buckets=512, chunk=2 ** 20):
+        self.factor = factor
+        self.n_samples = 0 if data is None else len(data)
+        self.mins = []
+        self.maxs = []
+        if self.n_samples < factor:
+            return
+
+        # first level straight from the data, chunk by chunk (chunk is a multiple of factor)
+        chunk = max(factor, chunk - chunk % factor)
+        mins, maxs = [], []
+        for start in range(0, self.n_samples, chunk):
+            block = np.asarray(data[start:start + chunk], dtype=float)
+            block = block.reshape(len(block), -1)
+            lo, hi = self._reduce(block, block)
+            mins.append(lo)
+            maxs.append(hi)
+        self.mins.append(np.concatenate(mins))
+        self.maxs.append(np.concatenate(maxs))
+
+        while len(self.mins[-1]) >= max(min_buckets, factor):
+            lo, hi = self._reduce(self.mins[-1], self.maxs[-1])
+            self.mins.append(lo)
+            self.maxs.append(hi)
+
+    def _reduce(self, lo, hi):
+        """Merge every factor rows into one, the last bucket may be shorter."""
+        n = len(lo)
+        full = n - n % self.factor
+        shape = (full // self.factor, self.factor) + lo.shape[1:]
+        new_lo = lo[:full].reshape(shape).min(axis=1)
+        new_hi = hi[:full].reshape(shape).max(axis=1)
+        if full < n:
+            new_lo = np.concatenate((new_lo, lo[full:].min(axis=0, keepdims=True)))
+            new_hi = np.concatenate((new_hi, hi[full:].max(axis=0, keepdims=True)))
+        return new_lo, new_hi
+
+    def bucket_size(self, level):
+        return self.factor ** level
+
+    def level_for(self, start, stop, max_points):
+        """Finest level drawing [start, stop) with at most max_points points (0 means the raw samples)."""
+        level = 0
+        while level < len(self.mins) and (stop - start) / self.bucket_size(level) > max_points / (2 if level else 1):
+            level += 1
+        return min(level, len(self.mins))
+
+    def query(self, data, start, stop, max_points):
+        """
+        Returns:
+          sample indices and (n_points, n_channels) values to draw for [start, stop).
+          At min/max levels every bucket gives two points, its min and its max.
+        """
+        start = max(0, int(start))
+        stop = min(self.n_samples, int(np.ceil(stop)))
+        level = self.level_for(start, stop, max_points)
+        if level == 0:
+            values = np.asarray(data[start:stop], dtype=float)
+            return np.arange(start, stop), values.reshape(len(values), -1)
+
+        size = self.bucket_size(level)
+        first, last = start // size, -(-stop // size)
+        lo, hi = self.mins[level - 1][first:last], self.maxs[level - 1][first:last]
+        index = np.arange(first, last) * size
+        values = np.empty((2 * len(lo),) + lo.shape[1:])
+        values[0::2] = lo
+        values[1::2] = hi
+        return np.repeat(index, 2) + np.tile([0, size // 2], len(lo)), values
+
+    def save(self, path, source=None):
+        """Save the pyramid; source is the file it was computed from, to detect when it changes."""
+        arrays = {'mins_%d' % k: lo for k, lo in enumerate(self.mins)}
+        arrays.update({'maxs_%d' % k: hi for k, hi in enumerate(self.maxs)})
+        np.savez(path, factor=self.factor, n_samples=self.n_samples, levels=len(self.mins),
+                 source=np.array(_signature(source)), **arrays)
+
+    @classmethod
+    def load(cls, path, source=None):
+        """The saved pyramid, or None if it is missing or source changed since it was saved."""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as saved:
+            if source is not None and tuple(saved['source']) != _signature(source):
+                return None
+            pyramid = cls(None)
+            pyramid.factor = int(saved['factor'])
+            pyramid.n_samples = int(saved['n_samples'])
+            pyramid.mins = [saved['mins_%d' % k] for k in range(int(saved['levels']))]
+            pyramid.maxs = [saved['maxs_%d' % k] for k in range(int(saved['levels']))]
+        return pyramid
+
+    @classmethod
+    def cached(cls, data, cache_path, source=None, **kwargs):
+        """Load the pyramid from cache_path if it is still valid, otherwise build and save it."""
+        pyramid = cls.load(cache_path, source)
+        if pyramid is None or pyramid.n_samples != len(data):
+            pyramid = cls(data, **kwargs)
+            pyramid.save(cache_path, source)
+        return pyramid
+
+    def __len__(self):
+        return self.n_samples
+
+
+def _signature(path):
+    if path is None:
+        return (0.0, 0.0)
+    stat = os.stat(path)
+    return (float(stat.st_size), float(stat.st_mtime))
+
+
+class LODPlot(object):
+    """
+    Lines of a long recording on ax, redrawn at the resolution of the visible range on every zoom or pan.
+    Keep a reference to it while the figure is open, matplotlib only keeps weak references to callbacks.
+    Args:
+      ax: matplotlib axes.
+      data: (n_samples,) or (n_samples, n_channels).
+      times: x value of every sample, defaults to the sample index / fs.
+      fs: sampling frequency, used when times is not given.
+      pyramid: a MinMaxPyramid of data; built (or loaded from cache_path) if not given.
+      cache_path: where to cache the pyramid, e.g. next to the recording.
+      source: file the data comes from, the cache is rebuilt when it changes.
+      max_points: points per line, 2 per pixel of the axes by default.
+      line_kwargs: passed to ax.plot.
+    """
+
+    def __init__(self, ax, data, times=None, fs=250.0, pyramid=None, cache_path=None, source=None,
+                 max_points=None, **line_kwargs):
+        self.ax = ax
+        self.data = data
+        self.times = None if times is None else np.asarray(times)
+        self.fs = fs
+        if pyramid is None:
+            pyramid = (MinMaxPyramid.cached(data, cache_path, source) if cache_path
+                       else MinMaxPyramid(data))
+        self.pyramid = pyramid
+        self.max_points = max_points
+
+        index, values = self.pyramid.query(self.data, 0, len(self.pyramid), self._max_points())
+        self.lines = ax.plot(self._x(index), values, **line_kwargs)
+        ax.set_xlim(self._x(np.array([0, len(self.pyramid) - 1])))
+        ax.callbacks.connect('xlim_changed', self._on_xlim_changed)
+
+    def _max_points(self):
+        if self.max_points:
+            return self.max_points
+        return max(200, int(2 * self.ax.bbox.width))
+
+    def _x(self, index):
+        if self.times is None:
+            return index / self.fs
+        return self.times[np.minimum(index, len(self.times) - 1)]
+
+    def _to_index(self, x):
+        if self.times is None:
+            return x * self.fs
+        return np.searchsorted(self.times, x)
+
+    def _on_xlim_changed(self, ax):
+        left, right = ax.get_xlim()
+        start = max(0, int(self._to_index(left)) - 1)
+        stop = min(len(self.pyramid), int(np.ceil(self._to_index(right))) + 1)
+        if stop <= start:
+            return
+        index, values = self.pyramid.query(self.data, start, stop, self._max_points())
+        x = self._x(index)
+        for c, line in enumerate(self.lines):
+            line.set_data(x, values[:, c])
+        ax.figure.canvas.draw_idle()
+
+
+if __name__ == "__main__":
+    import tempfile
+    import timeit
+
+    import matplotlib.pyplot as plt
+
+    fs = 250.0
+    hours = 4
+    rng = np.random.default_rng(0)
+    data = np.cumsum(rng.normal(0, 1, int(fs * 3600 * hours))).astype(np.float32)
+    print("%d h at %.0f Hz: %d samples" % (hours, fs, len(data)))
+
+    start = timeit.default_timer()
+    pyramid = MinMaxPyramid(data)
+    print("Pyramid built in %.2f s, %d levels" % (timeit.default_timer() - start, len(pyramid.mins)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = tmp + '/signal.npy'
+        np.save(source, data)
+        cache = source + '.lod.npz'
+        MinMaxPyramid.cached(data, cache, source)
+        start = timeit.default_timer()
+        MinMaxPyramid.cached(data, cache, source)
+        print("Pyramid loaded from cache in %.3f s" % (timeit.default_timer() - start))
+
+    fig, ax = plt.subplots(figsize=(16, 8))
+    lod = LODPlot(ax, data, fs=fs)
+    for name, xlim in (("whole recording", (0, len(data) / fs)), ("10 min", (3600, 4200)), ("10 s", (3600, 3610))):
+        start = timeit.default_timer()
+        ax.set_xlim(xlim)
+        fig.canvas.draw()
+        print("%s: %d points drawn in %.3f s" % (name, len(lod.lines[0].get_xdata()), timeit.default_timer() - start))
+
+    start = timeit.default_timer()
+    fig, ax = plt.subplots(figsize=(16, 8))
+    ax.plot(np.arange(len(data)) / fs, data)
+    fig.canvas.draw()
+    print("Plain plot of every sample: %.3f s" % (timeit.default_timer() - start))
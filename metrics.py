@@ -0,0 +1,367 @@
+"""
+Throughput and jitter metrics of a stream over a rolling window, on perf_counter_ns.
+Every update is O(1): counts go into the current time slice, and the window is the sum of the
+last slices. Queries may come from any thread.
+EXAMPLE USE:
+metrics = StreamMetrics(expected_rate=250.0)
+metrics.attach(board)  # bytes/s read from the serial port
+board.start_streaming(metrics.sample_callback(handle_sample))
+...
+print(metrics.snapshot()['interval_p99_ms'])
+with MetricsExporter(metrics, path='session.metrics.jsonl'):
+    board.start_streaming(handle_sample)
+"""
+import json
+import math
+import sys
+import threading
+import time
+
+import numpy as np
+
+_NS_PER_S = 10 ** 9
+
+
+class _Slice(object):
+    __slots__ = ('id', 'samples', 'bytes', 'intervals', 'interval_sum', 'interval_sumsq', 'interval_max', 'hist')
+
+    def __init__(self, n_bins):
+        self.hist = [0] * n_bins
+        self.reset(-1)
+
+    def reset(self, slice_id):
+        self.id = slice_id
+        self.samples = 0
+        self.bytes = 0
+        self.intervals = 0
+        self.interval_sum = 0
+        self.interval_sumsq = 0
+        self.interval_max = 0
+        for i in range(len(self.hist)):
+            self.hist[i] = 0
+
+
+class StreamMetrics(object):
+    """
+    Samples/s, bytes/s and the distribution of the intervals between samples over the last
+    window_seconds.
+    Args:
+      window_seconds: length of the rolling window.
+      slice_seconds: resolution of the window; it moves in steps of this length.
+      expected_rate: nominal sample rate, reported along with the measured one.
+      bins_per_decade: resolution of the log-spaced interval histogram, from 1 us to 100 s;
+          percentiles are accurate to the bin width, 2.3 % with 100 bins per decade.
+    """
+
+    MIN_INTERVAL_NS = 1000
+
+    def __init__(self, window_seconds=10.0, slice_seconds=1.0, expected_rate=None, bins_per_decade=100):
+        self.slice_ns = int(slice_seconds * _NS_PER_S)
+        self.n_slices = max(1, int(round(window_seconds / slice_seconds)))
+        self.expected_rate = expected_rate
+        self.bins_per_decade = bins_per_decade
+        self._log_min = math.log10(self.MIN_INTERVAL_NS)
+        n_bins = 8 * bins_per_decade + 1
+        self._slices = [_Slice(n_bins) for _ in range(self.n_slices)]
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            for s in self._slices:
+                s.reset(-1)
+            self.samples_total = 0
+            self.bytes_total = 0
+            self._last_tick = None
+            self._first_ns = None
+
+    def attach(self, board):
+        """Count the bytes the board reads from its serial port."""
+        board.metrics = self
+
+    def _slice(self, now):
+        # the caller holds the lock
+        slice_id = now // self.slice_ns
+        current = self._slices[slice_id % self.n_slices]
+        if current.id != slice_id:
+            current.reset(slice_id)
+        return current
+
+    def _bin(self, interval_ns):
+        if interval_ns <= self.MIN_INTERVAL_NS:
+            return 0
+        return min(int((math.log10(interval_ns) - self._log_min) * self.bins_per_decade),
+                   len(self._slices[0].hist) - 1)
+
+    def tick(self, n=1, now=None):
+        """
+        Record n samples arriving now; the interval since the previous tick goes into the histogram.
+        Args:
+          now: perf_counter_ns() of the arrival, taken here by default.
+        """
+        if now is None:
+            now = time.perf_counter_ns()
+        with self._lock:
+            current = self._slice(now)
+            current.samples += n
+            self.samples_total += n
+            if self._last_tick is not None:
+                interval = now - self._last_tick
+                current.intervals += 1
+                current.interval_sum += interval
+                current.interval_sumsq += interval * interval
+                if interval > current.interval_max:
+                    current.interval_max = interval
+                current.hist[self._bin(interval)] += 1
+            else:
+                self._first_ns = now
+            self._last_tick = now
+
+    def add_bytes(self, n, now=None):
+        if now is None:
+            now = time.perf_counter_ns()
+        with self._lock:
+            self._slice(now).bytes += n
+            self.bytes_total += n
+            if self._first_ns is None:
+                self._first_ns = now
+
+    def sample_callback(self, callback=None):
+        """start_streaming callback ticking once per sample before calling callback."""
+        def call(sample):
+            self.tick()
+            if callback is not None:
+                callback(sample)
+        return call
+
+    def block_callback(self, callback=None):
+        """start_block_streaming callback; intervals are then measured between blocks."""
+        def call(channel_data, aux_data, ids, timestamps):
+            self.tick(len(ids))
+            if callback is not None:
+                callback(channel_data, aux_data, ids, timestamps)
+        return call
+
+    def _window(self, now):
+        """Slices in the window and its length in seconds. The caller holds the lock."""
+        last_id = now // self.slice_ns
+        slices = [s for s in self._slices if last_id - self.n_slices < s.id <= last_id]
+        start = (last_id - self.n_slices + 1) * self.slice_ns
+        if self._first_ns is not None:
+            start = max(start, self._first_ns)
+        return slices, max(now - start, 1) / _NS_PER_S
+
+    def rate(self):
+        """Samples per second over the window."""
+        now = time.perf_counter_ns()
+        with self._lock:
+            slices, seconds = self._window(now)
+            return sum(s.samples for s in slices) / seconds
+
+    def _percentile(self, hist, count, q):
+        target = q * count
+        seen = 0
+        for i, c in enumerate(hist):
+            seen += c
+            if seen >= target and c:
+                # geometric centre of the bin
+                return 10 ** (self._log_min + (i + 0.5) / self.bins_per_decade) / 1e6
+        return 0.0
+
+    def snapshot(self):
+        """
+        Returns:
+          dict with samples/s and bytes/s over the window, the mean, p50, p99 and max interval
+          between samples and its standard deviation (jitter) in ms, and the totals since reset.
+        """
+        now = time.perf_counter_ns()
+        with self._lock:
+            slices, seconds = self._window(now)
+            samples = sum(s.samples for s in slices)
+            n = sum(s.intervals for s in slices)
+            total = sum(s.interval_sum for s in slices)
+            total_sq = sum(s.interval_sumsq for s in slices)
+            hist = [sum(counts) for counts in zip(*(s.hist for s in slices))] if slices else []
+            snapshot = {
+                'time': time.time(),
+                'window_s': seconds,
+                'samples_per_sec': samples / seconds,
+                'expected_rate': self.expected_rate,
+                'bytes_per_sec': sum(s.bytes for s in slices) / seconds,
+                'intervals': n,
+                'interval_mean_ms': total / n / 1e6 if n else 0.0,
+                'interval_p50_ms': self._percentile(hist, n, 0.5),
+                'interval_p99_ms': self._percentile(hist, n, 0.99),
+                'interval_max_ms': max((s.interval_max for s in slices), default=0) / 1e6,
+                'jitter_ms': math.sqrt(max(total_sq / n - (total / n) ** 2, 0)) / 1e6 if n else 0.0,
+                'samples_total': self.samples_total,
+                'bytes_total': self.bytes_total,
+            }
+        return snapshot
+
+    def format(self, snapshot=None):
+        s = self.snapshot() if snapshot is None else snapshot
+        expected = ' (expected %.0f)' % s['expected_rate'] if s['expected_rate'] else ''
+        return ("%.1f samples/s%s | %.0f B/s | interval p50 %.2f ms, p99 %.2f ms, max %.2f ms | jitter %.3f ms"
+                % (s['samples_per_sec'], expected, s['bytes_per_sec'], s['interval_p50_ms'],
+                   s['interval_p99_ms'], s['interval_max_ms'], s['jitter_ms']))
+
+
+class ParserStats(object):
+    """
+    Counters and timers of the board's packet parser and stream loops, enabled with
+    OpenBCIBoard.enable_parser_stats(). Updated once per block read from the port (and once per
+    callback), so the cost does not grow with the number of bytes. Only the reading thread
+    writes them; snapshot() may be called from any thread.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started_ns = time.perf_counter_ns()
+        self.reads = 0
+        self.bytes_read = 0
+        self.read_wait_ns = 0  # time blocked in ser.read
+        self.decode_ns = 0  # framing and decoding
+        self.packets = 0
+        self.resyncs = 0  # blocks that had to skip bytes to find a packet
+        self.skipped_bytes = 0
+        self.bad_end_bytes = 0
+        self.id_gaps = 0  # jumps in the packet id sequence
+        self.missing_ids = 0  # packets missing according to those jumps
+        self.callbacks = 0
+        self.callback_ns = 0
+        self._last_id = None
+
+    def record_read(self, n_bytes, wait_ns):
+        self.reads += 1
+        self.bytes_read += n_bytes
+        self.read_wait_ns += wait_ns
+
+    def record_decode(self, ids, n_bad, decode_ns):
+        self.decode_ns += decode_ns
+        self.bad_end_bytes += n_bad
+        if not len(ids):
+            return
+        self.packets += len(ids)
+        previous = ids[0] - 1 if self._last_id is None else self._last_id
+        # ids count 0-255 and wrap around
+        gaps = (np.diff(ids, prepend=previous) - 1) % 256
+        self.id_gaps += int(np.count_nonzero(gaps))
+        self.missing_ids += int(gaps.sum())
+        self._last_id = int(ids[-1])
+
+    def record_resync(self, n_bytes):
+        self.resyncs += 1
+        self.skipped_bytes += n_bytes
+
+    def record_callback(self, callback_ns):
+        self.callbacks += 1
+        self.callback_ns += callback_ns
+
+    def snapshot(self):
+        """
+        Returns:
+          dict with the counters since reset, the per-minute rate of resyncs, skipped bytes and
+          missing packets, and the read-wait, decode and callback times in ms, also per packet in us.
+        """
+        elapsed = (time.perf_counter_ns() - self.started_ns) / _NS_PER_S
+        minutes = max(elapsed, 1e-9) / 60
+        packets = max(self.packets, 1)
+        return {
+            'elapsed_s': elapsed,
+            'reads': self.reads,
+            'bytes_read': self.bytes_read,
+            'packets': self.packets,
+            'resyncs': self.resyncs,
+            'skipped_bytes': self.skipped_bytes,
+            'bad_end_bytes': self.bad_end_bytes,
+            'id_gaps': self.id_gaps,
+            'missing_ids': self.missing_ids,
+            'resyncs_per_min': self.resyncs / minutes,
+            'skipped_bytes_per_min': self.skipped_bytes / minutes,
+            'missing_ids_per_min': self.missing_ids / minutes,
+            'read_wait_ms': self.read_wait_ns / 1e6,
+            'decode_ms': self.decode_ns / 1e6,
+            'callback_ms': self.callback_ns / 1e6,
+            'callbacks': self.callbacks,
+            'decode_us_per_packet': self.decode_ns / packets / 1e3,
+            'callback_us_per_packet': self.callback_ns / packets / 1e3,
+        }
+
+
+class MetricsExporter(object):
+    """
+    Background thread writing a snapshot every interval seconds, as a JSON line appended to path,
+    or as a readable line on stream when no path is given.
+    """
+
+    def __init__(self, metrics, interval=1.0, path=None, stream=sys.stdout):
+        self.metrics = metrics
+        self.interval = interval
+        self.path = path
+        self.stream = stream
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def export(self):
+        snapshot = self.metrics.snapshot()
+        if self.path:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(snapshot) + '\n')
+        else:
+            self.stream.write(self.metrics.format(snapshot) + '\n')
+            self.stream.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.export()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+    import timeit
+
+    from cyton_emulator import CytonEmulator
+    from open_bci_v3 import OpenBCIBoard
+
+    parser = argparse.ArgumentParser(description="Metrics of a stream from the Cyton emulator.")
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    metrics = StreamMetrics()
+    n = 10 ** 6
+    start = timeit.default_timer()
+    for _ in range(n):
+        metrics.tick()
+    print("tick(): %.2f us per sample" % ((timeit.default_timer() - start) / n * 1e6))
+
+    with CytonEmulator(sample_rate=250.0) as emulator:
+        board = OpenBCIBoard(port=emulator.port, log=False)
+        metrics = StreamMetrics(expected_rate=board.getSampleRate())
+        metrics.attach(board)
+        with MetricsExporter(metrics):
+            board.start_streaming(metrics.sample_callback(), lapse=args.seconds)
+        if board.checktimer:
+            board.checktimer.cancel()
+        print(json.dumps(metrics.snapshot(), indent=2))
+        board.disconnect()
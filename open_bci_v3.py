@@ -20,7 +20,19 @@ import logging
 import threading
 import sys
 #import pdb
+import fnmatch
 import glob
+import os
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from copy import deepcopy
+
+import serial.tools.list_ports
+
+from metrics import ParserStats
+from ring_buffer import SampleRingBuffer
+from supervisor import ConnectionSupervisor
 
 # @NOTE: This is not ENFORCED in the board !!! The board uses whatever sampling frequency it has been previously configured.
 SAMPLE_RATE = 250.0  # Hz
@@ -30,6 +42,13 @@ ADS1299_Vref = 4.5  # reference voltage for ADC in ADS1299.  set by its hardware
 ADS1299_gain = 24.0  # assumed gain setting for ADS1299.  set by its Arduino code
 scale_fac_uVolts_per_count = ADS1299_Vref / float((pow(2, 23) - 1)) / ADS1299_gain * 1000000.
 scale_fac_accel_G_per_count = 0.002 / (pow(2, 4))  # assume set to +/4G, so 2 mG
+PACKET_SIZE = 33  # bytes per packet, start and end byte included
+EEG_CHANNELS_PER_PACKET = 8
+AUX_CHANNELS_PER_PACKET = 3
+_PACKET_OFFSETS = np.arange(PACKET_SIZE)
+DONGLE_USB_IDS = {(0x0403, 0x6015)}  # (VID, PID) of the FTDI chip in the OpenBCI dongle
+PORT_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.openbci_port')  # last port a board was found on
+RADIO_CHANNEL_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.openbci_radio_channel')  # last channel in use
 '''
 #Commands for in SDK http://docs.openbci.com/software/01-Open BCI_SDK:
 command_stop = "s";
@@ -50,6 +69,176 @@ command_biasFixed = "~";
 '''
 
 
+def read_until(ser, terminator=b'$$$', timeout=1.0):
+    """
+    Read from ser until terminator arrives or timeout seconds have passed, whichever comes first.
+    Returns:
+      The bytes read, ending with terminator unless the deadline passed first.
+    """
+    deadline = timeit.default_timer() + timeout
+    saved_timeout = ser.timeout
+    data = bytearray()
+    try:
+        while terminator not in data:
+            remaining = deadline - timeit.default_timer()
+            if remaining <= 0:
+                break
+            ser.timeout = remaining
+            data += ser.read(max(1, ser.in_waiting))
+    finally:
+        ser.timeout = saved_timeout
+    return bytes(data)
+
+
+def parse_radio_channel(reply):
+    """
+    Channel number in a 'Success: Host and Device on Channel Number: 7$$$' reply, None if there is none.
+    Bytes around the message, e.g. left from a previous reply, are ignored.
+    """
+    match = re.search(r'Host and Device on Channel Number:\s*(\d+)', reply)
+    return int(match.group(1)) if match else None
+
+
+def probe_port(port, baudrate=115200, timeout=2.0):
+    """True if an OpenBCI board answers 'v' on port within timeout seconds. Never raises."""
+    try:
+        with serial.Serial(port=port, baudrate=baudrate, timeout=timeout) as ser:
+            ser.reset_input_buffer()
+            ser.write(b'v')
+            reply = read_until(ser, b'$$$', timeout)
+    except (OSError, serial.SerialException) as e:
+        logging.debug("Cannot probe %s: %s" % (port, e))
+        return False
+    return b'OpenBCI' in reply or b'Rainbow' in reply
+
+
+def candidate_ports():
+    """Serial ports that may have the dongle, the ones with its USB VID/PID first."""
+    if sys.platform.startswith('win'):
+        patterns = ('COM*',)
+    elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
+        patterns = ('/dev/ttyUSB*',)
+    elif sys.platform.startswith('darwin'):
+        patterns = ('/dev/tty.usbserial*', '/dev/cu.usbserial*')
+    else:
+        raise EnvironmentError('Error finding ports on your operating system')
+
+    listed = serial.tools.list_ports.comports()
+    dongles = [p.device for p in listed if (p.vid, p.pid) in DONGLE_USB_IDS]
+    others = [p.device for p in listed if p.device not in dongles
+              and any(fnmatch.fnmatch(p.device, pattern) for pattern in patterns)]
+    for pattern in patterns:
+        others.extend(port for port in sorted(glob.glob(pattern)) if port not in dongles + others)
+    return dongles + others
+
+
+def _read_cache(path):
+    try:
+        with open(path) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _write_cache(path, value):
+    try:
+        with open(path, 'w') as f:
+            f.write('%s\n' % value)
+    except OSError as e:
+        logging.warning("Cannot cache %s in %s: %s" % (value, path, e))
+
+
+def read_port_cache(path=None):
+    return _read_cache(path or PORT_CACHE_FILE)
+
+
+def write_port_cache(port, path=None):
+    _write_cache(path or PORT_CACHE_FILE, port)
+
+
+def read_radio_channel_cache(path=None):
+    channel = _read_cache(path or RADIO_CHANNEL_CACHE_FILE)
+    return int(channel) if channel and channel.isdigit() else None
+
+
+def write_radio_channel_cache(channel, path=None):
+    _write_cache(path or RADIO_CHANNEL_CACHE_FILE, channel)
+
+
+def find_packets(buf):
+    """
+    Locate packets in a block of raw bytes: a START_BYTE with an END_BYTE
+    PACKET_SIZE - 1 bytes later.
+    Args:
+      buf: uint8 numpy array with the bytes read from the board.
+    Returns:
+      starts: offsets of the non-overlapping, well framed packets.
+      bad: offsets of start bytes outside those packets whose end byte did not match, at most
+          one per PACKET_SIZE bytes: the bytes after a bad start are its payload, so a stray
+          START_BYTE there is not counted as another bad packet.
+    """
+    n = len(buf) - PACKET_SIZE + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    is_start = buf[:n] == START_BYTE
+    is_end = buf[PACKET_SIZE - 1:] == END_BYTE
+    starts = np.flatnonzero(is_start & is_end)
+    bad = np.flatnonzero(is_start & ~is_end)
+
+    # A start byte inside the payload of a previous packet can also look framed, keep the first one
+    if len(starts) > 1 and np.any(np.diff(starts) < PACKET_SIZE):
+        keep = []
+        next_free = 0
+        for s in starts.tolist():
+            if s >= next_free:
+                keep.append(s)
+                next_free = s + PACKET_SIZE
+        starts = np.array(keep, dtype=np.intp)
+
+    # start bytes that belong to the payload of a valid packet are just data
+    if len(bad) and len(starts):
+        owner = np.searchsorted(starts, bad, side='right') - 1
+        inside = (owner >= 0) & (bad < starts[np.maximum(owner, 0)] + PACKET_SIZE)
+        bad = bad[~inside]
+
+    # one bad packet per window, as the byte by byte parser skipped a whole packet after a bad start
+    if len(bad) > 1 and np.any(np.diff(bad) < PACKET_SIZE):
+        keep = []
+        next_free = 0
+        for b in bad.tolist():
+            if b >= next_free:
+                keep.append(b)
+                next_free = b + PACKET_SIZE
+        bad = np.array(keep, dtype=np.intp)
+    return starts, bad
+
+
+def decode_packets(buf, starts, scaled_output=True):
+    """
+    Decode all packets of a block at once.
+    Args:
+      buf: uint8 numpy array with the raw bytes.
+      starts: packet offsets, as returned by find_packets.
+      scaled_output: convert counts to uV and G instead of returning raw counts.
+    Returns:
+      ids (N,), channel_data (N, 8) and aux_data (N, 3) arrays.
+    """
+    packets = buf[starts[:, None] + _PACKET_OFFSETS]
+    ids = packets[:, 1].astype(np.int64)
+
+    # 24 bit big endian ints in 2s complement: shift into the top of an int32 and back to sign extend
+    raw = packets[:, 2:2 + 3 * EEG_CHANNELS_PER_PACKET].reshape(-1, EEG_CHANNELS_PER_PACKET, 3).astype(np.int32)
+    channel_data = ((raw[..., 0] << 24) | (raw[..., 1] << 16) | (raw[..., 2] << 8)) >> 8
+
+    # 16 bit big endian signed shorts
+    aux_data = np.ascontiguousarray(packets[:, 2 + 3 * EEG_CHANNELS_PER_PACKET:PACKET_SIZE - 1]).view('>i2')
+    aux_data = aux_data.astype(np.int32)
+
+    if scaled_output:
+        return ids, channel_data * scale_fac_uVolts_per_count, aux_data * scale_fac_accel_G_per_count
+    return ids, channel_data, aux_data
+
+
 class OpenBCIBoard(object):
     """
     Handle a connection to an OpenBCI board.
@@ -57,10 +246,15 @@ class OpenBCIBoard(object):
       port: The port to connect to.
       baud: The baud of the serial connection.
       daisy: Enable or disable daisy module and 16 chans readings
+      fast_connect: go on with each step of the handshake as soon as the board answers,
+          instead of sleeping fixed delays, and reuse the port instead of opening a second one.
+      handshake_timeout: seconds to wait at most for the reply to each handshake command
+          (with fast_connect) and to the radio channel query.
     """
 
     def __init__(self, port=None, baud=115200, filter_data=True,
-                 scaled_output=True, daisy=False, log=True, timeout=10,sendDeviceStopAfterSerialStop=True):
+                 scaled_output=True, daisy=False, log=True, timeout=10,sendDeviceStopAfterSerialStop=True,
+                 fast_connect=False, handshake_timeout=2.0):
         # @FIXME: Watch out --> changed the default timeout to 10 seconds.
         self.log = log  # print_incoming_text needs log
         self.streaming = False
@@ -71,9 +265,20 @@ class OpenBCIBoard(object):
         self.log_packet_count = 0
         self.initSendBoardByteString = b''
         self.callback = None
-        self.radio_channel_number = 0
-        self.checktimer = None
+        self.block_callback = None
+        self.block_size = None
+        self.max_latency = None
+        self.radio_channel_number = 0  # 0 until known, then kept for get_radio_channel_number() and reconnect()
+        self.handshake_timeout = handshake_timeout
+        self.checktimer = None  # the supervisor, kept under its old name so checktimer.cancel() still works
+        self.supervisor = None
+        self.reconnecting = False
+        self.last_data_time = timeit.default_timer()
+        self._reconnect_requested = threading.Event()
         self.audio = False
+        self.recorders = []  # flushed on stop(), closed on disconnect()
+        self.metrics = None  # metrics.StreamMetrics counting the bytes read while streaming
+        self.parser_stats = None  # metrics.ParserStats, see enable_parser_stats()
 
         if not port:
             port = self.find_port()
@@ -91,56 +296,50 @@ class OpenBCIBoard(object):
             print("baudrate_serial of " + str(self.baudrate_serial) + " not handled")
             # sys.exit(0)
 
-        time.sleep(2)
-        self.ser = serial.Serial(port=port, baudrate=self.baudrate_default, timeout=timeout)
-        print("Serial with baud rate of " + str(self.baudrate_default) + " established to port " + port)
-
-        # Initialize 32-bit board, doesn't affect 8bit board
-        self.ser.write(b'v')
-        time.sleep(1)
-
-        temp_line_read = ""
-        self.openBCIFirmwareVersion = "v1"
-        while temp_line_read != "No Message":
-            temp_line_read = self.print_incoming_text()
-            if "Rainbow V1" in temp_line_read:
-                self.openBCIFirmwareVersion = "v3"              # The Rainbow board V1 is equivalent to OpenBCI v3
-                self.audio = True
-                print("Rainbow Board detected!")
-            if "Firmware: v2." in temp_line_read:
-                self.openBCIFirmwareVersion = "v2"
-            if "Firmware: v3" in temp_line_read:
-                self.openBCIFirmwareVersion = "v3"
-            if "Firmware: v4" in temp_line_read:
-                self.openBCIFirmwareVersion = "v4"
+        if fast_connect:
+            self._fast_connect(port, baud, handshake_timeout)
+        else:
+            time.sleep(2)
+            self.ser = serial.Serial(port=port, baudrate=self.baudrate_default, timeout=timeout)
+            print("Serial with baud rate of " + str(self.baudrate_default) + " established to port " + port)
+
+            # Initialize 32-bit board, doesn't affect 8bit board
+            self.ser.write(b'v')
+            time.sleep(1)
+
+            temp_line_read = ""
+            self.openBCIFirmwareVersion = "v1"
+            while temp_line_read != "No Message":
+                temp_line_read = self.print_incoming_text()
+                self._detect_firmware(temp_line_read)
         
-        print("OpenBCI Firmware " + self.openBCIFirmwareVersion + " detected")
+            print("OpenBCI Firmware " + self.openBCIFirmwareVersion + " detected")
 
-        #print('Setting OpenBCI Radio Channel to: 7')
-        getchannel = b'\xF0\x01\x07'.decode("cp1250")
-        #self.ser.write(getchannel.encode("utf-8"))
+            #print('Setting OpenBCI Radio Channel to: 7')
+            getchannel = b'\xF0\x01\x07'.decode("cp1250")
+            #self.ser.write(getchannel.encode("utf-8"))
 
-        self.get_radio_channel_number()
+            self.get_radio_channel_number()
 
 
-        if  self.openBCIFirmwareVersion != "v1":
-            self.ser.write(self.baudrate_serial_code.encode("utf-8"))
-            self.ser.baudrate = self.baudrate
+            if  self.openBCIFirmwareVersion != "v1":
+                self.ser.write(self.baudrate_serial_code.encode("utf-8"))
+                self.ser.baudrate = self.baudrate
 
-            print("Serial reconfigured to baud rate of " + str(baud) + " on port " + port)
+                print("Serial reconfigured to baud rate of " + str(baud) + " on port " + port)
 
-            # @FIXME: This is insane
-            s = serial.Serial(port=port, baudrate=self.baudrate_default, timeout=self.timeout)
-            print("Connected, asking id")
-            time.sleep(2)
-            s.write(b'v')
-            openbci_serial_connected = self.openbci_id(s)
-            s.close()
+                # @FIXME: This is insane
+                s = serial.Serial(port=port, baudrate=self.baudrate_default, timeout=self.timeout)
+                print("Connected, asking id")
+                time.sleep(2)
+                s.write(b'v')
+                openbci_serial_connected = self.openbci_id(s)
+                s.close()
 
-            print(self.ser)
+                print(self.ser)
 
-        else:
-            print("Serial baud rate of " + str(baud) + " on port " + port + " NOT supported by " + self.openBCIFirmwareVersion + " switching to default baud rate of " + str(baud) )
+            else:
+                print("Serial baud rate of " + str(baud) + " on port " + port + " NOT supported by " + self.openBCIFirmwareVersion + " switching to default baud rate of " + str(baud) )
 
         # wait for device to be ready
 
@@ -156,6 +355,11 @@ class OpenBCIBoard(object):
         self.last_reconnect = 0
         self.reconnect_freq = 5
         self.packets_dropped = 0
+        self._read_buffer = bytearray()  # raw bytes not yet decoded
+        self._pending_samples = deque()  # decoded samples not yet handed out by _read_serial_binary
+        self._daisy_pending = None  # first half of a daisy pair waiting for the second one
+        self.ring = None
+        self.acquisition_thread = None
 
 
         
@@ -164,6 +368,54 @@ class OpenBCIBoard(object):
         # Disconnects from board when terminated
         atexit.register(self.disconnect)
 
+    def _detect_firmware(self, text):
+        """Set openBCIFirmwareVersion (and audio for Rainbow boards) from the reply to 'v'."""
+        if "Rainbow V1" in text:
+            self.openBCIFirmwareVersion = "v3"              # The Rainbow board V1 is equivalent to OpenBCI v3
+            self.audio = True
+            print("Rainbow Board detected!")
+        if "Firmware: v2." in text:
+            self.openBCIFirmwareVersion = "v2"
+        if "Firmware: v3" in text:
+            self.openBCIFirmwareVersion = "v3"
+        if "Firmware: v4" in text:
+            self.openBCIFirmwareVersion = "v4"
+
+    def _fast_connect(self, port, baud, handshake_timeout):
+        """
+        Handshake driven by the board's replies: every step goes on as soon as the '$$$'
+        terminator arrives, after handshake_timeout seconds at most. The port is opened once.
+        """
+        self.ser = serial.Serial(port=port, baudrate=self.baudrate_default, timeout=self.timeout)
+        print("Serial with baud rate of " + str(self.baudrate_default) + " established to port " + port)
+        self.ser.reset_input_buffer()
+
+        # Initialize 32-bit board, doesn't affect 8bit board
+        self.ser.write(b'v')
+        banner = read_until(self.ser, b'$$$', handshake_timeout).decode('utf-8', 'replace')
+        self.openBCIFirmwareVersion = "v1"
+        if banner:
+            print(banner)
+            self._detect_firmware(banner)
+        else:
+            self.warn("No Message")
+        print("OpenBCI Firmware " + self.openBCIFirmwareVersion + " detected")
+
+        self.get_radio_channel_number(refresh=True)
+
+        if self.openBCIFirmwareVersion == "v1":
+            print("Serial baud rate of " + str(baud) + " on port " + port + " NOT supported by " + self.openBCIFirmwareVersion + " switching to default baud rate of " + str(baud) )
+        elif baud != self.baudrate_default:
+            self.ser.write(self.baudrate_serial_code.encode("cp1250"))
+            read_until(self.ser, b'$$$', handshake_timeout)
+            self.ser.baudrate = baud
+            print("Serial reconfigured to baud rate of " + str(baud) + " on port " + port)
+            # check the board still answers at the new rate, on the same port
+            self.ser.write(b'v')
+            banner = read_until(self.ser, b'$$$', handshake_timeout)
+            if b'OpenBCI' not in banner and b'Rainbow' not in banner:
+                self.warn('No answer from the board at baud rate %d' % baud)
+
     def getSampleRate(self):
         if self.daisy:
             return SAMPLE_RATE / 2
@@ -199,6 +451,7 @@ class OpenBCIBoard(object):
             callback = [callback]
 
         self.callback = callback
+        self.block_callback = None
 
 
         # Initialize check connection
@@ -208,9 +461,14 @@ class OpenBCIBoard(object):
 
     def stream(self,lapse, start_time):
         while self.streaming:
+            if self._reconnect_requested.is_set():
+                self._recover()
+                continue
 
             # read current sample
             sample = self._read_serial_binary()
+            if sample is None:
+                continue
             # if a daisy module is attached, wait to concatenate two samples (main board + daisy) before passing it to callback
             if self.daisy:
                 # odd sample: daisy sample, save for later
@@ -223,23 +481,185 @@ class OpenBCIBoard(object):
 
                     whole_sample = OpenBCISample(sample.id, sample.channel_data + self.last_odd_sample.channel_data,
                                                  avg_aux_data)
-                    for call in self.callback:
-                        call(whole_sample)
+                    self._call_sample_callbacks(whole_sample)
             else:
-                for call in self.callback:
-                    call(sample)
+                self._call_sample_callbacks(sample)
             if (lapse > 0 and timeit.default_timer() - start_time > lapse):
                 self.stop()
             if self.log:
                 self.log_packet_count = self.log_packet_count + 1
 
+    def _call_sample_callbacks(self, sample):
+        stats = self.parser_stats
+        if stats is None:
+            for call in self.callback:
+                call(sample)
+            return
+        callback_start = time.perf_counter_ns()
+        for call in self.callback:
+            call(sample)
+        stats.record_callback(time.perf_counter_ns() - callback_start)
+
+    def start_block_streaming(self, callback, block_size=None, max_latency=None, lapse=-1):
+        """
+        Start handling streaming data from the board in blocks. Call a provided callback
+        once per block instead of once per sample.
+        Args:
+          callback: A callback function -- or a list of functions -- that will receive
+              (channel_data, aux_data, ids, timestamps): an (N, getNbEEGChannels()) array,
+              an (N, getNbAUXChannels()) array and the (N,) packet ids and timestamps.
+          block_size: number of samples per call, None to pass every block as it comes from the port.
+          max_latency: seconds; hand over a smaller block if its oldest sample has waited this long.
+        """
+        if not self.streaming:
+            self.ser.write(b'b')
+            self.streaming = True
+
+        start_time = timeit.default_timer()
+
+        if not isinstance(callback, list):
+            callback = [callback]
+
+        self.block_callback = callback
+        self.block_size = block_size
+        self.max_latency = max_latency
+
+        # Initialize check connection
+        self.check_connection()
+
+        self.stream_blocks(lapse, start_time)
+
+    def stream_blocks(self, lapse, start_time):
+        block_size = self.block_size
+        max_latency = self.max_latency
+        stats = self.parser_stats
+        chunks = []  # blocks read but not handed over yet
+        buffered = 0
+        first_arrival = None
+        while self.streaming:
+            if self._reconnect_requested.is_set():
+                self._recover()
+                continue
+            batch = self._read_block()
+            now = timeit.default_timer()
+            if len(batch):
+                chunks.append(batch)
+                buffered += len(batch)
+                if first_arrival is None:
+                    first_arrival = now
+
+            while chunks and (block_size is None or buffered >= block_size
+                              or (max_latency is not None and now - first_arrival >= max_latency)):
+                pending = SampleBatch.concatenate(chunks)
+                n = block_size if block_size is not None and buffered >= block_size else buffered
+                block = pending[:n]
+                if stats is not None:
+                    callback_start = time.perf_counter_ns()
+                for call in self.block_callback:
+                    call(block.channel_data, block.aux_data, block.ids, block.time)
+                if stats is not None:
+                    stats.record_callback(time.perf_counter_ns() - callback_start)
+
+                buffered -= n
+                if buffered:
+                    chunks = [pending[n:]]
+                    first_arrival = now
+                else:
+                    chunks = []
+                    first_arrival = None
+
+            if (lapse > 0 and timeit.default_timer() - start_time > lapse):
+                self.stop()
+            if self.log:
+                self.log_packet_count = self.log_packet_count + len(batch)
+
     def restream(self,lapse=-1):
         if not self.streaming:
             self.ser.write(b'b')
             self.streaming = True
 
         start_time = timeit.default_timer()
-        self.stream(lapse,start_time)
+        if self.block_callback:
+            self.stream_blocks(lapse, start_time)
+        else:
+            self.stream(lapse,start_time)
+
+    def enable_parser_stats(self):
+        """
+        Start counting resyncs, bad end bytes, id gaps and timing reads, decoding and callbacks.
+        Returns:
+          The metrics.ParserStats being updated; its snapshot() gives the numbers so far.
+        """
+        if self.parser_stats is None:
+            self.parser_stats = ParserStats()
+        return self.parser_stats
+
+    def disable_parser_stats(self):
+        self.parser_stats = None
+
+    def start_acquisition(self, capacity=int(SAMPLE_RATE * 60)):
+        """
+        Start streaming into a ring buffer from a dedicated reader thread, so slow consumers
+        don't hold back the serial reads.
+        Args:
+          capacity: number of samples the ring keeps before overwriting the oldest ones.
+        Returns:
+          The SampleRingBuffer the samples are written to.
+        """
+        self.ring = SampleRingBuffer(capacity, self.getNbEEGChannels(), self.getNbAUXChannels())
+        if not self.streaming:
+            self.ser.write(b'b')
+            self.streaming = True
+        self.check_connection()
+        self.acquisition_thread = threading.Thread(target=self._acquire, daemon=True)
+        self.acquisition_thread.start()
+        return self.ring
+
+    def stop_acquisition(self):
+        self.stop()
+        if self.acquisition_thread is not None:
+            self.ser.cancel_read()
+            self.acquisition_thread.join()
+            self.acquisition_thread = None
+
+    def _acquire(self):
+        while self.streaming:
+            if self._reconnect_requested.is_set():
+                self._recover()
+                continue
+            batch = self._read_block()
+            self.ring.write(batch.ids, batch.channel_data, batch.aux_data, batch.time)
+            if self.log:
+                self.log_packet_count = self.log_packet_count + len(batch)
+
+    def _read_block(self):
+        """
+        Read a block of samples, with daisy halves already merged.
+        Returns:
+          A SampleBatch, with timestamps spaced by the sample period and ending at the time of the read.
+        """
+        ids, channel_data, aux_data = self._read_serial_block()
+        now = timeit.default_timer()
+        if self.daisy:
+            ids, channel_data, aux_data = self._merge_daisy(ids, channel_data, aux_data)
+        timestamps = now - np.arange(len(ids) - 1, -1, -1) / self.getSampleRate()
+        return SampleBatch(ids, channel_data, aux_data, timestamps)
+
+    def _merge_daisy(self, ids, channel_data, aux_data):
+        """Block version of the pairing done in stream(): an even id followed by the next odd id."""
+        if self._daisy_pending is not None:
+            pending_id, pending_channels, pending_aux = self._daisy_pending
+            ids = np.concatenate(([pending_id], ids))
+            channel_data = np.concatenate((pending_channels[None], channel_data))
+            aux_data = np.concatenate((pending_aux[None], aux_data))
+        self._daisy_pending = None
+        if len(ids) and ids[-1] % 2 == 0:
+            self._daisy_pending = (ids[-1], channel_data[-1], aux_data[-1])
+
+        second = np.flatnonzero((ids[1:] % 2 == 1) & (ids[1:] - 1 == ids[:-1])) + 1
+        first = second - 1
+        merged = np.concatenate((channel_data[second], channel_data[first]), axis=1)
+        return ids[second], merged, (aux_data[second] + aux_data[first]) / 2
 
 
 
@@ -252,95 +672,89 @@ class OpenBCIBoard(object):
       33 bytes
     """
 
-    def _read_serial_binary(self, max_bytes_to_skip=5000):
-        def read(n):
-            bb = self.ser.read(n)
+    def _read_serial_block(self, max_bytes_to_skip=5000):
+        """
+        Read everything available from the port and decode all complete packets in it.
+        Bytes that do not frame a packet are skipped to resync, incomplete packets are kept
+        for the next call.
+        Returns:
+          ids (N,), channel_data (N, 8) and aux_data (N, 3) arrays. N is 0 if no packet was
+          found within max_bytes_to_skip bytes.
+        """
+        stats = self.parser_stats
+        skipped = 0
+        while True:
+            needed = PACKET_SIZE - len(self._read_buffer)
+            if stats is not None:
+                wait_start = time.perf_counter_ns()
+            bb = self.ser.read(max(self.ser.in_waiting, needed))
+            if stats is not None:
+                stats.record_read(len(bb), time.perf_counter_ns() - wait_start)
             if not bb:
+                empty = decode_packets(np.frombuffer(b'', dtype=np.uint8), np.empty(0, dtype=np.intp))
+                if not self.streaming or self._reconnect_requested.is_set():
+                    # read cancelled by stop() or by the supervisor
+                    return empty
+                if self.supervisor is not None and self.supervisor.is_alive():
+                    self.warn('Device appears to be stalled.')
+                    self._reconnect_requested.set()
+                    return empty
                 self.warn('Device appears to be stalled. Quitting...')
                 sys.exit()
-                raise Exception('Device Stalled')
-                sys.exit(0)
-                return '\xFF'
+            self.last_data_time = timeit.default_timer()
+            if self.metrics is not None:
+                self.metrics.add_bytes(len(bb))
+            self._read_buffer += bb
+
+            if stats is not None:
+                decode_start = time.perf_counter_ns()
+            buf = np.frombuffer(self._read_buffer, dtype=np.uint8)
+            starts, bad = find_packets(buf)
+
+            for b in bad.tolist():
+                self.warn("ID:<%d> <Unexpected END_BYTE found <%s> instead of <%s>"
+                          % (buf[b + 1], buf[b + PACKET_SIZE - 1], END_BYTE))
+                logging.debug('|'.join(str(v) for v in buf[b:b + PACKET_SIZE]))
+            if len(starts):
+                # drops only count if no good packet arrived after them
+                self.packets_dropped = int(np.count_nonzero(bad > starts[-1]))
             else:
-                return bb
-
-        for rep in range(max_bytes_to_skip):
-
-            # ---------Start Byte & ID---------
-            if self.read_state == 0:
-
-                b = read(1)
-
-                if struct.unpack('B', b)[0] == START_BYTE:
-                    if (rep != 0):
-                        self.warn('Skipped %d bytes before start found' % (rep))
-                        rep = 0;
-                    packet_id = struct.unpack('B', read(1))[0]  # packet id goes from 0-255
-                    log_bytes_in = str(packet_id);
-
-                    self.read_state = 1
-
-            # ---------Channel Data---------
-            elif self.read_state == 1:
-                channel_data = []
-                for c in range(self.eeg_channels_per_sample):
-
-                    # 3 byte ints
-                    literal_read = read(3)
-
-                    unpacked = struct.unpack('3B', literal_read)
-                    log_bytes_in = log_bytes_in + '|' + str(literal_read);
-
-                    # 3byte int in 2s compliment
-                    if (unpacked[0] >= 127):
-                        pre_fix = bytes(bytearray.fromhex('FF'))
-                    else:
-                        pre_fix = bytes(bytearray.fromhex('00'))
-
-                    literal_read = pre_fix + literal_read;
-
-                    # unpack little endian(>) signed integer(i) (makes unpacking platform independent)
-                    myInt = struct.unpack('>i', literal_read)[0]
-
-                    if self.scaling_output:
-                        channel_data.append(myInt * scale_fac_uVolts_per_count)
-                    else:
-                        channel_data.append(myInt)
-
-                self.read_state = 2;
-
-            # ---------Accelerometer Data---------
-            elif self.read_state == 2:
-                aux_data = []
-                for a in range(self.aux_channels_per_sample):
-
-                    # short = h
-                    acc = struct.unpack('>h', read(2))[0]
-                    log_bytes_in = log_bytes_in + '|' + str(acc);
-
-                    if self.scaling_output:
-                        aux_data.append(acc * scale_fac_accel_G_per_count)
-                    else:
-                        aux_data.append(acc)
-
-                self.read_state = 3;
-            # ---------End Byte---------
-            elif self.read_state == 3:
-                val = struct.unpack('B', read(1))[0]
-                log_bytes_in = log_bytes_in + '|' + str(val);
-                self.read_state = 0  # read next packet
-                if (val == END_BYTE):
-                    sample = OpenBCISample(packet_id, channel_data, aux_data)
-                    self.packets_dropped = 0
-                    sample.marker = ''                              # @NOTE Added for LSL compatibility
-                    sample.markertimestamp = timeit.default_timer() # @NOTE Added for LSL compatibility
-                    sample.filtered = 0
-                    return sample
-                else:
-                    self.warn("ID:<%d> <Unexpected END_BYTE found <%s> instead of <%s>"
-                              % (packet_id, val, END_BYTE))
-                    logging.debug(log_bytes_in);
-                    self.packets_dropped = self.packets_dropped + 1
+                self.packets_dropped = self.packets_dropped + len(bad)
+
+            # keep the bytes that may still become a packet
+            if len(starts):
+                consumed = max(int(starts[-1]) + PACKET_SIZE, len(buf) - PACKET_SIZE + 1)
+            else:
+                consumed = max(0, len(buf) - PACKET_SIZE + 1)
+            skipped += consumed - PACKET_SIZE * len(starts)
+
+            ids, channel_data, aux_data = decode_packets(buf, starts, self.scaling_output)
+            del buf
+            del self._read_buffer[:consumed]
+            if stats is not None:
+                stats.record_decode(ids, len(bad), time.perf_counter_ns() - decode_start)
+
+            if len(starts):
+                if skipped:
+                    self.warn('Skipped %d bytes before start found' % (skipped))
+                    if stats is not None:
+                        stats.record_resync(skipped)
+                return ids, channel_data, aux_data
+            if skipped >= max_bytes_to_skip:
+                self.warn('Skipped %d bytes without finding a packet' % (skipped))
+                if stats is not None:
+                    stats.record_resync(skipped)
+                return ids, channel_data, aux_data
+
+    def _read_serial_binary(self, max_bytes_to_skip=5000):
+        """Return the next OpenBCISample, decoding a new block from the port when needed."""
+        while not self._pending_samples:
+            ids, channel_data, aux_data = self._read_serial_block(max_bytes_to_skip)
+            if not len(ids) and (not self.streaming or self._reconnect_requested.is_set()):
+                return None
+            for packet_id, channels, aux in zip(ids.tolist(), channel_data.tolist(), aux_data.tolist()):
+                self._pending_samples.append(OpenBCISample(packet_id, channels, aux))
+        return self._pending_samples.popleft()
 
 
 
@@ -352,6 +766,7 @@ class OpenBCIBoard(object):
         self.ser.timeout = 1
         self.ser.write(b's')
         time.sleep(1)
+        self._read_buffer.clear()
         fencecounter = 0
         if self.ser.inWaiting():
             timeouted = False
@@ -377,10 +792,14 @@ class OpenBCIBoard(object):
             self.ser.write(b's')
             if self.log:
                 logging.warning('sent <s>: stopped streaming')
+        for recorder in self.recorders:
+            recorder.flush()
 
     def disconnect(self):
         if (self.streaming == True):
             self.stop(True)
+        for recorder in self.recorders:
+            recorder.close()
         if (self.ser.isOpen()):
             print("Closing Serial...")
             self.ser.close()
@@ -508,72 +927,89 @@ class OpenBCIBoard(object):
         time.sleep(1.5)   
         self.print_incoming_text(); 
 
-    # @NOTE: added this new function to change the host's radio channel 
-    def set_radio_channel_override(self, radio_channel):
+    # @NOTE: added this new function to change the host's radio channel
+    def set_radio_channel_override(self, radio_channel, timeout=0.1):
+        """Set the dongle to radio_channel; returns its reply, empty if none came within timeout."""
         self.ser.write(bytes([0xF0, 0x02, radio_channel]))
-        time.sleep(0.1)   
-
-    # @NOTE: added this new function to scan through channels until a success message has been found    
-    def scan_channels(self):
-        success = False 
-        for channel_number in range(1, 26):
-
-            # Host channel override
-            self.set_radio_channel_override(channel_number)
+        return read_until(self.ser, b'$$$', timeout).decode('utf-8', 'replace')
 
-            # Discards override data
-            while self.ser.in_waiting > 0:
-                self.ser.read()
-
-            # Channel Status
-            self.ser.write(bytes([0xF0, 0x07]))
-            time.sleep(0.1)
-
-            mes = []
-            while self.ser.in_waiting > 0:
-                mes.append(chr(self.ser.read(1)[0]))
-            received_string = "".join(mes)
-
-            if received_string == "Success: System is Up$$$":
+    def _channel_is_up(self, channel_number, timeout, retries):
+        """
+        Override the dongle's channel and ask for the system status, both commands written at once.
+        Replies are read until the status arrives or timeout seconds have passed since the commands,
+        retries included.
+        """
+        deadline = timeit.default_timer() + timeout
+        # Host channel override, then Channel Status
+        self.ser.write(bytes([0xF0, 0x02, channel_number, 0xF0, 0x07]))
+        buffer = b''
+        while True:
+            remaining = deadline - timeit.default_timer()
+            if remaining <= 0:
+                return False
+            buffer += read_until(self.ser, b'$$$', remaining)
+            *replies, buffer = buffer.split(b'$$$')
+            for reply in replies:
+                reply = reply.decode('utf-8', 'replace')
+                if 'System is Up' in reply:
+                    return True
+                if 'System is Down' in reply:
+                    return False
+                if 'Host' in reply:
+                    continue  # the override's reply, not needed
+                logging.debug("Garbled reply on channel %d: %r" % (channel_number, reply))
+                if retries <= 0:
+                    return False
+                retries -= 1
+                self.ser.write(bytes([0xF0, 0x07]))
+
+    # @NOTE: added this new function to scan through channels until a success message has been found
+    def scan_channels(self, channels=range(1, 26), timeout=0.15, retries=1):
+        """
+        Find the radio channel of the board: set the dongle to each channel and ask for the
+        system status, moving on as soon as it answers or after timeout seconds. The channel
+        in use last time is tried first. A scan of 25 channels with no board takes at most
+        25 * timeout seconds.
+        Args:
+          timeout: seconds per channel, retries included.
+          retries: extra status requests on a channel whose reply is garbled.
+        Returns:
+          The channel found, also kept in radio_channel_number, or None.
+        """
+        previous = self.radio_channel_number or read_radio_channel_cache()
+        order = list(channels)
+        if previous in order:
+            order.remove(previous)
+            order.insert(0, previous)
+
+        for channel_number in order:
+            if self._channel_is_up(channel_number, timeout, retries):
                 print(f"Successfully connected to channel: {channel_number}")
-                success = True
-                return channel_number 
+                self.radio_channel_number = channel_number
+                write_radio_channel_cache(channel_number)
+                return channel_number
 
-        if not success:
-            print("Could not connect, is your board powered on?")
-            return None
-            
-    def get_radio_channel_number(self):
-        data = [0xF0,0x00]
-        self.ser.write(bytes(data))
-        time.sleep(1.5)
-
-        line = ''
-        data = b''
-        channelnumber = 0
+        print("Could not connect, is your board powered on?")
+        return None
 
-        res = False
+    def get_radio_channel_number(self, refresh=False):
+        """
+        Radio channel of the board. Once known it is kept, the dongle is only asked again with refresh.
+        """
+        if self.radio_channel_number and not refresh:
+            return self.radio_channel_number
 
         print('Reading Radio Channel.')
+        self.ser.write(bytes([0xF0, 0x00]))
+        line = read_until(self.ser, b'$$$', self.handshake_timeout).decode('utf-8', 'replace')
+        print(line)
 
-        try:
-            line = ''
-            c = ''
-            # Look for end sequence $$$
-            timeouted = False
-            while ('$$$' not in line) and not timeouted:
-                c = self.ser.read()
-                if c == '':
-                    timeouted = True
-                print(c)
-                line += c.decode("utf-8")
-            if "Channel" in line:
-                res = True
-            channelnumber = int(line.split(':')[2][:-4])
-        except:
+        channelnumber = parse_radio_channel(line)
+        if channelnumber is None:
             self.warn('Cannot identify Radio Channel Number.')
-            
-        print (line)
+            channelnumber = 0
+        else:
+            write_radio_channel_cache(channelnumber)
 
         self.radio_channel_number = channelnumber
 
@@ -650,42 +1086,107 @@ class OpenBCIBoard(object):
                 self.reconnect()
 
     
-    def check_connection(self, interval=2, max_packets_to_skip=10):
-        # check number of dropped packages and establish connection problem if too large
-        if self.packets_dropped > max_packets_to_skip:
-            # if error, attempt to reconect
-            self.reconnect()
-        # check again again in 2 seconds
-        self.checktimer = threading.Timer(interval, self.check_connection)
-        self.checktimer.start()
+    def check_connection(self, interval=2, max_packets_to_skip=10, **supervisor_args):
+        """
+        Start the supervisor thread watching the stream, if it is not running yet. Only one runs
+        per board; it ends when streaming stops or on checktimer.cancel().
+        Args:
+          supervisor_args: more supervisor.ConnectionSupervisor settings, e.g. the backoff.
+        """
+        if self.supervisor is not None and self.supervisor.is_alive() and not self.supervisor.cancelled:
+            return
+        self.last_data_time = timeit.default_timer()
+        self.supervisor = ConnectionSupervisor(self, interval, max_packets_to_skip, **supervisor_args)
+        self.checktimer = self.supervisor
+        self.supervisor.start()
+
+    def request_reconnect(self):
+        """
+        Ask the streaming thread to reconnect before its next read, interrupting the read in progress.
+        Safe to call from any thread.
+        """
+        self._reconnect_requested.set()
+        if self.ser.is_open:
+            self.ser.cancel_read()
 
     def reconnect(self):
-        # This is a soft disconnect, disconnects and reconnects the streaming.
-        self.packets_dropped = 0
-        self.warn('Reconnecting')
-        self.stop(sendDeviceStopAfterSerialStop=True)  # try if you can to send stop
-        time.sleep(0.5)
-        self.ser.baudrate = self.baudrate_default
-        self.ser.write(b'v')
-        time.sleep(0.5)
-        self.ser.write(self.baudrate_serial_code.encode("utf-8"))
-        self.ser.baudrate = self.baudrate
-        time.sleep(0.5)
-        self.ser.write(b'v')
-        time.sleep(0.5)
-        self.ser.write(self.initSendBoardByteString)
-        time.sleep(0.5)
-
-        self.get_radio_channel_number()
-
-
-
+        """
+        Soft disconnect and reconnect. While streaming, the stream loop does it between two
+        reads and goes on streaming; otherwise it happens right here.
+        Returns:
+          Whether the board answered, None when left to the stream loop.
+        """
+        if self.streaming:
+            self.request_reconnect()
+            return None
+        return self._reconnect_link(resume=False)
 
- #       hasSerialMessage = True
- #       while hasSerialMessage:
- #           hasSerialMessage = self.print_incoming_text()
-        self.restream()
-        # self.attempt_reconnect = False
+    def _recover(self):
+        """Reconnect with exponential backoff until data flows again, stop() is called or attempts run out."""
+        supervisor = self.supervisor or ConnectionSupervisor(self)
+        self.reconnecting = True
+        start = timeit.default_timer()
+        try:
+            for attempt, delay in enumerate(supervisor.backoff(), 1):
+                if not self.streaming:
+                    return False
+                self.warn('Reconnecting (attempt %d)' % attempt)
+                if self._reconnect_link():
+                    elapsed = timeit.default_timer() - start
+                    supervisor.recovery_times.append(elapsed)
+                    self.warn('Reconnected in %.2f s after %d attempt(s)' % (elapsed, attempt))
+                    return True
+                supervisor.failed_attempts += 1
+                if supervisor.max_attempts and attempt >= supervisor.max_attempts:
+                    self.warn('Could not reconnect after %d attempts, stopping' % attempt)
+                    self.stop()
+                    return False
+                wait_until = timeit.default_timer() + delay
+                while self.streaming and timeit.default_timer() < wait_until:
+                    time.sleep(min(0.05, delay))
+        finally:
+            self._reconnect_requested.clear()
+            self.last_data_time = timeit.default_timer()
+            self.reconnecting = False
+
+    def _reconnect_link(self, resume=True):
+        """
+        One reconnection attempt: stop the board, check it answers (scanning the radio channels,
+        the last one first, if it doesn't), restore the baud rate and settings and, with resume,
+        start streaming again.
+        """
+        self.packets_dropped = 0
+        try:
+            self.ser.write(b's')
+            self.ser.baudrate = self.baudrate_default
+            self.ser.reset_input_buffer()
+            self._read_buffer.clear()
+            self._pending_samples.clear()
+            self._daisy_pending = None
+
+            self.ser.write(b'v')
+            banner = read_until(self.ser, b'$$$', self.handshake_timeout)
+            if b'OpenBCI' not in banner and b'Rainbow' not in banner:
+                # the link may be down, or the board moved to another radio channel
+                if self.scan_channels() is None:
+                    return False
+                self.ser.write(b'v')
+                banner = read_until(self.ser, b'$$$', self.handshake_timeout)
+                if b'OpenBCI' not in banner and b'Rainbow' not in banner:
+                    return False
+
+            if self.baudrate != self.baudrate_default and self.openBCIFirmwareVersion != "v1":
+                self.ser.write(self.baudrate_serial_code.encode("cp1250"))
+                read_until(self.ser, b'$$$', self.handshake_timeout)
+                self.ser.baudrate = self.baudrate
+            if self.initSendBoardByteString:
+                self.ser.write(self.initSendBoardByteString)
+            if resume:
+                self.ser.write(b'b')
+        except (OSError, serial.SerialException) as e:
+            self.warn('Reconnection failed: %s' % e)
+            return False
+        return True
 
     # Adds a filter at 60hz to cancel out ambient electrical noise
     def enable_filters(self):
@@ -788,45 +1289,43 @@ class OpenBCIBoard(object):
             if channel == 16 and self.daisy:
                 self.ser.write(b'i')
 
-    def find_port(self):
-        # Finds the serial port names
-        if sys.platform.startswith('win'):
-            print("detected windows system")
-            ports = ['COM%s' % (i + 1) for i in range(256)]
-        elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
-            print("detected unix system")
-            ports = glob.glob('/dev/ttyUSB*')
-        elif sys.platform.startswith('darwin'):
-            print("detected darwin system")
-            ports = glob.glob('/dev/tty.usbserial*')
-        else:
-            print('Error finding ports on your operating system')
-            raise EnvironmentError('Error finding ports on your operating system')
-        openbci_port = ''
+    def find_port(self, timeout=2.0):
+        """
+        Find the port of the dongle: the cached last known port is tried first, then every
+        candidate port is probed at the same time, each for timeout seconds at most. The cached
+        port is probed again with the others, it may just have been slow to answer, and it may be
+        a name like COM10 that candidate_ports doesn't list.
+        """
+        cached = read_port_cache()
+        if cached and probe_port(cached, self.baudrate_default, timeout):
+            print("OpenBCI found on cached port %s" % cached)
+            return cached
+
+        ports = candidate_ports()
+        if cached and cached not in ports:
+            ports.insert(0, cached)
         print("Available ports")
         print(ports)
-        for port in ports:
-            try:
-                s = serial.Serial(port=port, baudrate=self.baudrate_default, timeout=self.timeout)
-                print("Connected, asking id")
-                time.sleep(2)
-                s.write(b'v')
-                openbci_serial_connected = self.openbci_id(s)
-                s.close()
-                if openbci_serial_connected:
-                    openbci_port = port;
-            except (OSError,serial.SerialException) as o:
-                print("Exception while opening serial port:" % o)
-                raise OSError("Cannot find OpenBCI port")
+        openbci_port = ''
+        if ports:
+            executor = ThreadPoolExecutor(max_workers=len(ports))
+            probes = {executor.submit(probe_port, port, self.baudrate_default, timeout): port for port in ports}
+            for probe in as_completed(probes):
+                if probe.result():
+                    openbci_port = probes[probe]
+                    break
+            # the remaining probes end on their own within timeout
+            executor.shutdown(wait=False)
         if openbci_port == '':
             print('Cannot find identify OpenBCI board on port.')
             raise OSError('Cannot find identify OpenBCI board on port.')
-        else:
-            return openbci_port
+        write_port_cache(openbci_port)
+        return openbci_port
 
 
 class OpenBCISample(object):
     """Object encapulsating a single sample from the OpenBCI board."""
+    __slots__ = ('time', 'id', 'channel_data', 'aux_data', 'marker', 'markertimestamp', 'filtered')
 
     def __init__(self, packet_id, channel_data, aux_data, time=None):
         self.time = time
@@ -835,9 +1334,16 @@ class OpenBCISample(object):
         self.id = packet_id
         self.channel_data = channel_data
         self.aux_data = aux_data
+        self.marker = ''  # @NOTE Added for LSL compatibility
+        self.markertimestamp = self.time  # @NOTE Added for LSL compatibility
+        self.filtered = 0
 
     def __copy__(self):
-        return type(self)(self.id, self.channel_data, self.aux_data, self.time)
+        acopy = type(self)(self.id, self.channel_data, self.aux_data, self.time)
+        acopy.marker = self.marker
+        acopy.markertimestamp = self.markertimestamp
+        acopy.filtered = self.filtered
+        return acopy
 
     def __deepcopy__(self, memo):
         id_self = id(self)
@@ -848,5 +1354,83 @@ class OpenBCISample(object):
                 deepcopy(self.channel_data, memo),
                 deepcopy(self.aux_data, memo),
                 deepcopy(self.time, memo))
+            acopy.marker = self.marker
+            acopy.markertimestamp = self.markertimestamp
+            acopy.filtered = self.filtered
+            memo[id_self] = acopy
+        return acopy
+
+
+class SampleBatch(object):
+    """
+    Columnar block of samples backed by contiguous arrays, one row per sample.
+    Slicing returns a batch of views into the same arrays, indexing with an int returns an OpenBCISample.
+    Args:
+      ids: (N,) packet ids.
+      channel_data: (N, n_eeg) EEG channels.
+      aux_data: (N, n_aux) AUX channels.
+      time: (N,) timestamps.
+    """
+    __slots__ = ('ids', 'channel_data', 'aux_data', 'time')
+
+    def __init__(self, ids, channel_data, aux_data, time):
+        self.ids = np.asarray(ids)
+        self.channel_data = np.asarray(channel_data)
+        self.aux_data = np.asarray(aux_data)
+        self.time = np.asarray(time)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return OpenBCISample(int(self.ids[index]), self.channel_data[index].tolist(),
+                                 self.aux_data[index].tolist(), float(self.time[index]))
+        return type(self)(self.ids[index], self.channel_data[index], self.aux_data[index], self.time[index])
+
+    def __iter__(self):
+        return iter(self.to_samples())
+
+    @classmethod
+    def empty(cls, n_eeg, n_aux):
+        return cls(np.empty(0, dtype=np.int64), np.empty((0, n_eeg)), np.empty((0, n_aux)), np.empty(0))
+
+    @classmethod
+    def from_samples(cls, samples, n_eeg=EEG_CHANNELS_PER_PACKET, n_aux=AUX_CHANNELS_PER_PACKET):
+        """n_eeg, n_aux: channels of the batch when samples is empty, so it still concatenates."""
+        samples = list(samples)
+        if not samples:
+            return cls.empty(n_eeg, n_aux)
+        return cls(np.array([s.id for s in samples], dtype=np.int64),
+                   np.array([s.channel_data for s in samples], dtype=float),
+                   np.array([s.aux_data for s in samples], dtype=float),
+                   np.array([s.time for s in samples], dtype=float))
+
+    @classmethod
+    def concatenate(cls, batches):
+        batches = list(batches)
+        if len(batches) == 1:
+            return batches[0]
+        return cls(np.concatenate([b.ids for b in batches]),
+                   np.concatenate([b.channel_data for b in batches]),
+                   np.concatenate([b.aux_data for b in batches]),
+                   np.concatenate([b.time for b in batches]))
+
+    def to_samples(self):
+        return [OpenBCISample(packet_id, channels, aux, t) for packet_id, channels, aux, t in
+                zip(self.ids.tolist(), self.channel_data.tolist(), self.aux_data.tolist(), self.time.tolist())]
+
+    def __copy__(self):
+        return type(self)(self.ids, self.channel_data, self.aux_data, self.time)
+
+    def __deepcopy__(self, memo):
+        id_self = id(self)
+        acopy = memo.get(id_self)
+        if acopy is None:
+            acopy = type(self)(
+                deepcopy(self.ids, memo),
+                deepcopy(self.channel_data, memo),
+                deepcopy(self.aux_data, memo),
+                deepcopy(self.time, memo))
             memo[id_self] = acopy
         return acopy
@@ -4,13 +4,17 @@
 # ---------------------------------------------------------------------
 ########################################################################
 
-import csv
 import sys
 
-from scipy.signal import butter, iirnotch, filtfilt, lfilter
+from scipy.signal import butter, iirnotch, lfilter
 import numpy as np
 import matplotlib.pyplot as plt
 
+from csv_loader import load_signal
+from filters import filtfilt_chunked
+from lod_plot import LODPlot
+from recording import Recording, RECORDING_EXTENSION
+
 fs = 250
 dt = 1 / fs
 
@@ -32,13 +36,16 @@ def notch_filter(series, fs):
     f0 = 50.0
     Q = 30.0
     b, a = iirnotch(f0, Q, fs)
-    series = filtfilt( b, a, series)
+    # igual que filtfilt(b, a, series), pero por tramos de 1 min: los temporales del filtro son del tamaño de un tramo
+    series = filtfilt_chunked((b, a), np.asarray(series, dtype=float), chunk_samples=fs * 60)
     return series
 ############################################################################################################
 
-def plot_filtered_signal(muestras, tiempos):
+def plot_filtered_signal(muestras, tiempos, cache_path=None, source=None):
+    # Se dibujan como mucho ~2 puntos por píxel (mín/máx de cada tramo) y se recalcula al hacer zoom
     plt.figure(figsize=(16, 8))
-    plt.plot(tiempos, muestras, color='b', label="Señal (mV)")
+    lod = LODPlot(plt.gca(), muestras, tiempos, cache_path=cache_path, source=source,
+                  color='b', label="Señal (mV)")
     plt.xlabel("Tiempo (s)")
     plt.ylabel("Amplitud (mV)")
     plt.title("Señal Filtrada en el tiempo")
@@ -79,34 +86,34 @@ def plot_fourier(muestras, tiempos):
 try:
     csv_filename = sys.argv[1]
     print(f"Opening file {csv_filename}")
-    # Leer archivo CSV
-
-    with (open(csv_filename) as csvfile):
-        reader = csv.reader(csvfile, delimiter=',')
-        next(reader)  # Ignorar encabezados
-
-        # Leer columnas
-        repetitions = []
-        sample_values = []
-        tiempos = []
-        fps_values = []
-
-        for row in reader:
-            if int(row[0]) < 0:
-                continue
-            repetitions.append(int(row[0]))  # ID o índice, puede seguir siendo int
-            sample_values.append(float(row[1]))  # Valores de señal EEG, deben ser float
-            fps_values.append(float(row[2]))  # Si esta columna también tiene decimales
-            tiempos.append(float(row[0]) * dt)  # Asegurar que sea float
-
-        # Aplicar filtros
-        bandpass_filtered = butter_bandpass_filter(sample_values, 8, 12, 250, order=5)
-        # bandpass_filtered = butter_bandpass_filter(sample_values, 0.5, 20, 250, order=5)
-        #bandpass_filtered = notch_filter(bandpass_filtered, 250)
-
-        # Plotear resultados
-        plot_filtered_signal(bandpass_filtered, tiempos)
-        plot_fourier(bandpass_filtered, tiempos)
+
+    if csv_filename.endswith(RECORDING_EXTENSION):
+        # Grabación binaria: se lee solo el canal pedido (por defecto el 3, channel_data[2])
+        recording = Recording(csv_filename)
+        channel = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+        sample_values = recording.eeg(channels=channel)
+        tiempos = recording.times()
+    else:
+        # Leer archivo CSV (descarta las filas con Repetition negativa)
+        channel = None
+        repetitions, sample_values, tiempos = load_signal(csv_filename, fs)
+
+    # Aplicar filtros
+    lowcut, highcut, order = 8, 12, 5
+    # lowcut, highcut, order = 0.5, 20, 5
+    aplicar_notch = False
+    bandpass_filtered = butter_bandpass_filter(sample_values, lowcut, highcut, fs, order=order)
+    if aplicar_notch:
+        bandpass_filtered = notch_filter(bandpass_filtered, fs)
+
+    # Plotear resultados
+    # La pirámide de mín/máx se guarda junto a la grabación y se rehace si el archivo cambia;
+    # el nombre lleva el canal y el filtro, así otro canal u otra banda no reutilizan la de antes
+    lod_cache = '%s%s.bandpass_%g_%g_o%d%s.lod.npz' % (
+        csv_filename, '' if channel is None else '.ch%d' % channel, lowcut, highcut, order,
+        '.notch' if aplicar_notch else '')
+    plot_filtered_signal(bandpass_filtered, tiempos, cache_path=lod_cache, source=csv_filename)
+    plot_fourier(bandpass_filtered, tiempos)
 
 
     print("DONE")
@@ -4,11 +4,12 @@
 # ---------------------------------------------------------------------
 ########################################################################
 
-import csv
 import time
 import subprocess
-from Fps import Fps
+from band_power import BandPowerTracker
+from metrics import StreamMetrics, MetricsExporter
 from open_bci_v3 import OpenBCIBoard
+from recorder import Recorder
 from test_openbci import stop_streaming
 
 TIME_TO_STABILIZE = 6 * 30 # 3min
@@ -16,23 +17,27 @@ TIME_TO_START_RECORDING = 0
 TIME_TO_RECORD = 10 * 250 # 10 segs
 
 csv_filename = ""
+recorder = None
 repetitions = 0
 
 lowcut = 8.0
 highcut = 12.0
 fs = 250.0
-ffps = Fps()
-ffps.tic()
+# muestras/s, intervalos entre muestras (p50/p99/máx) y bytes/s del puerto
+metrics = StreamMetrics(expected_rate=fs)
+# potencia alpha de cada canal en vivo (uV^2, suavizada 1 s), actualizada 4 veces por segundo
+alpha_tracker = BandPowerTracker(fs, bands={'alpha': (lowcut, highcut)}, rate=4.0)
+track_alpha = alpha_tracker.sample_callback()
 
 def play_sound():
     subprocess.run(["afplay", "./note.mp3"])
     return
 
 # def just_print(sample):
-#     ffps.steptoc()
+#     metrics.tick()
 #
 #     sample_value = sample.channel_data[2]  # Extraer el dato relevante
-#     fps_value = ffps.fps  # Calcular FPS estimado
+#     fps_value = metrics.rate()  # muestras/s en la ventana
 #
 #     print(f"Estimated FPS: {fps_value:.2f} - Sample: {sample_value} ")
 
@@ -48,16 +53,17 @@ def handle_sample(sample):
         print("Signal stabilized, starting recording...")
         play_sound()
 
-    ffps.steptoc()
+    metrics.tick()
+    track_alpha(sample)
 
     sample_value = sample.channel_data[2]  # Extraer el dato relevante
-    fps_value = ffps.fps  # Calcular FPS estimado
+    fps_value = metrics.rate()  # muestras/s en la ventana
+    alpha_power = alpha_tracker.power('alpha')
+    alpha_value = alpha_power[2] if alpha_power is not None else 0.0
 
-    print(f"Estimated FPS: {fps_value:.2f} - Sample: {sample_value} ")
+    print(f"Estimated FPS: {fps_value:.2f} - Sample: {sample_value} - Alpha: {alpha_value:.1f} uV^2")
 
-    with open(csv_filename, mode='a', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow([repetitions, sample_value,fps_value])
+    recorder.record(sample)
 
     if repetitions >= 3750: # 10 segs
         print("Se alcanzó el límite de muestras [10segs], cerrando...")
@@ -72,14 +78,14 @@ try:
     numexp = input("Enter the number of the patients experiment: ")
     csv_filename = numexp + "_" + typeofexp + "_" +  patientname + "_raw.csv"
     # ie: 02_Pedro_raw.csv
+    alpha_tracker.condition = typeofexp
     #time_to_record = int(input("Enter the time to wait for the signal in seconds: "))
     time_to_record = TIME_TO_STABILIZE
 
-    with open('signal.csv', mode='w') as f:
-        writer = csv.writer(f)
-        writer.writerow(["Repetition", "Sample Value", "FPS"])
-
     board = OpenBCIBoard()
+    # all channels, aux, ids and timestamps; flushed in the background and on disconnect
+    recorder = Recorder(csv_filename, board=board)
+    metrics.attach(board)
     board.print_register_settings()
     board.get_radio_channel_number()
     print(f'OpenBCI connected to radio channel {board.radio_channel_number}')
@@ -89,6 +95,8 @@ try:
         print(f"stabilizing... {time_to_record-i}")
         time.sleep(1)
 
+    # métricas de la sesión, una línea JSON por segundo junto al CSV
+    MetricsExporter(metrics, path=csv_filename + '.metrics.jsonl').start()
     board.start_streaming(handle_sample)
     print("Signal stabilized, starting recording...")
 
@@ -0,0 +1,177 @@
+"""
+Buffered recorder for streamed samples. Rows are kept in memory and written by a
+background thread, so the acquisition loop never waits on the disk.
+EXAMPLE USE:
+recorder = Recorder('01_EC_pedro_raw.csv', board=board)
+board.start_streaming(recorder.record)
+...
+board.disconnect()  # flushes and closes the recorder
+"""
+import atexit
+import threading
+
+import numpy as np
+
+from open_bci_v3 import SAMPLE_RATE, SampleBatch
+from recording import RecordingWriter
+
+
+class Recorder(object):
+    """
+    Record every channel, aux, id and timestamp of a stream to a file.
+    Args:
+      filename: output file, overwritten.
+      mode: 'csv', readable by plot_filter.py, or 'binary', a recording.Recording file, much cheaper to write.
+      board: OpenBCIBoard to attach to, so stop() flushes and disconnect() closes the recorder.
+          Its sample rate, firmware and radio channel go into the header of binary recordings.
+      value_channel: channel copied to the "Sample Value" column of the csv.
+      value_column: name of that column.
+      flush_rows: flush as soon as this many rows are waiting.
+      flush_interval: flush at least every so many seconds.
+    """
+
+    def __init__(self, filename, mode='csv', board=None, value_channel=2, value_column='Sample Value',
+                 flush_rows=2500, flush_interval=1.0):
+        if mode not in ('csv', 'binary'):
+            raise ValueError("mode must be 'csv' or 'binary', not %r" % mode)
+        self.filename = filename
+        self.mode = mode
+        self.value_channel = value_channel
+        self.value_column = value_column
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.board = board
+        self.rows_written = 0
+        self.closed = False
+
+        # the binary writer needs the channel counts, it is created on the first flush
+        self._file = open(filename, 'w', newline='') if mode == 'csv' else None
+        self._writer = None
+        self._finished = False  # file closed, nothing more can be written
+        self._header_written = False
+        self._pending = []  # OpenBCISamples and SampleBatches, in arrival order
+        self._buffered = 0
+        self._lock = threading.Lock()  # guards _pending
+        self._write_lock = threading.Lock()  # one flush at a time
+        self._wake = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+        if board is not None:
+            self.attach(board)
+        atexit.register(self.close)
+
+    def attach(self, board):
+        board.recorders.append(self)
+
+    def record(self, sample):
+        """start_streaming callback. Raises ValueError once the recorder is closed, as file objects do."""
+        with self._lock:
+            self._check_open()
+            self._pending.append(sample)
+            self._buffered += 1
+            full = self._buffered >= self.flush_rows
+        if full:
+            self._wake.set()
+
+    def record_block(self, channel_data, aux_data, ids, timestamps):
+        """start_block_streaming callback. The arrays are kept until the next flush, don't modify them."""
+        with self._lock:
+            self._check_open()
+            self._pending.append(SampleBatch(ids, channel_data, aux_data, timestamps))
+            self._buffered += len(ids)
+            full = self._buffered >= self.flush_rows
+        if full:
+            self._wake.set()
+
+    def _check_open(self):
+        # under _lock, so nothing is added after close() took the last rows
+        if self.closed:
+            raise ValueError("I/O operation on closed recorder %s" % self.filename)
+
+    def _flush_loop(self):
+        while not self.closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if not self.closed:
+                self.flush()
+
+    def _take_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._buffered = 0
+        batches = []
+        samples = []
+        for item in pending:
+            if isinstance(item, SampleBatch):
+                if samples:
+                    batches.append(SampleBatch.from_samples(samples))
+                    samples = []
+                batches.append(item)
+            else:
+                samples.append(item)
+        if samples:
+            batches.append(SampleBatch.from_samples(samples))
+        return SampleBatch.concatenate(batches) if batches else None
+
+    def flush(self):
+        with self._write_lock:
+            if self._finished:
+                return
+            batch = self._take_pending()
+            if batch is None or not len(batch):
+                return
+            n = len(batch)
+            if self.mode == 'csv':
+                self._write_csv(batch, np.arange(self.rows_written, self.rows_written + n))
+                self._file.flush()
+            else:
+                self._write_binary(batch)
+            self.rows_written += n
+
+    def _write_binary(self, batch):
+        if self._writer is None:
+            self._writer = RecordingWriter(
+                self.filename, self.board.getSampleRate() if self.board else SAMPLE_RATE,
+                batch.channel_data.shape[1], batch.aux_data.shape[1],
+                firmware=self.board.openBCIFirmwareVersion if self.board else '',
+                radio_channel=self.board.radio_channel_number if self.board else 0,
+                start_time=batch.time[0])
+        scaled = self.board.scaling_output if self.board else True
+        self._writer.write(batch.ids, batch.channel_data, batch.aux_data, batch.time, scaled)
+        self._writer.flush()
+
+    def _write_csv(self, batch, repetitions):
+        n_eeg = batch.channel_data.shape[1]
+        n_aux = batch.aux_data.shape[1]
+        if not self._header_written:
+            header = (['Repetition', self.value_column, 'FPS', 'ID', 'Timestamp']
+                      + ['EEG %d' % (c + 1) for c in range(n_eeg)] + ['AUX %d' % (c + 1) for c in range(n_aux)])
+            self._file.write(','.join(header) + '\n')
+            self._header_written = True
+
+        # samples per second over this flush
+        elapsed = batch.time[-1] - batch.time[0]
+        fps = (len(batch) - 1) / elapsed if elapsed > 0 else 0.0
+
+        rows = np.column_stack((repetitions, batch.channel_data[:, self.value_channel],
+                                np.full(len(batch), fps), batch.ids, batch.time,
+                                batch.channel_data, batch.aux_data))
+        fmt = ['%d', '%.6f', '%.2f', '%d', '%.6f'] + ['%.6f'] * (n_eeg + n_aux)
+        np.savetxt(self._file, rows, fmt=fmt, delimiter=',')
+
+    def close(self):
+        if self.closed:
+            return
+        with self._lock:
+            self.closed = True
+        self._wake.set()
+        self._flusher.join()
+        self.flush()
+        with self._write_lock:
+            if self._file is not None:
+                self._file.close()
+            if self._writer is not None:
+                self._writer.close()
+            self._finished = True
+        atexit.unregister(self.close)
@@ -0,0 +1,155 @@
+"""
+Binary recording format for long sessions, read back through np.memmap so that
+only the part being looked at is loaded.
+File layout (little endian):
+  Header(256): magic "OBCIREC\\0" | version(2) | header size(2) | sample rate(8) | EEG channels(2) |
+               AUX channels(2) | uV per count(8) | G per count(8) | firmware(16) | radio channel(2) |
+               start time(8) | zero padding
+  Records: id(1) | timestamp(8) | EEG counts, 4 bytes each | AUX counts, 2 bytes each
+The number of records follows from the file size, so a recording cut short is still readable.
+EXAMPLE USE:
+recording = Recording('01_EC_pedro_raw.obci')
+alpha_window = recording.eeg(120, 130, channels=slice(0, 4))  # channels 1-4 from 120 s to 130 s
+"""
+import os
+import struct
+
+import numpy as np
+
+from open_bci_v3 import SAMPLE_RATE, scale_fac_uVolts_per_count, scale_fac_accel_G_per_count
+
+RECORDING_EXTENSION = '.obci'
+MAGIC = b'OBCIREC\x00'
+VERSION = 1
+HEADER_SIZE = 256
+_HEADER = struct.Struct('<8sHHdHHdd16sHd')
+
+
+def record_dtype(n_eeg, n_aux):
+    return np.dtype([('id', '<u1'), ('time', '<f8'), ('eeg', '<i4', (n_eeg,)), ('aux', '<i2', (n_aux,))])
+
+
+class RecordingWriter(object):
+    """
+    Append samples to a recording file.
+    Args:
+      filename: output file, overwritten.
+      sample_rate, n_eeg, n_aux: stream layout.
+      scale_eeg, scale_aux: uV and G per count, used to store scaled values as counts.
+      firmware: board firmware version, e.g. board.openBCIFirmwareVersion.
+      radio_channel: radio channel of the dongle.
+      start_time: timestamp of the start of the session.
+    """
+
+    def __init__(self, filename, sample_rate=SAMPLE_RATE, n_eeg=8, n_aux=3, scale_eeg=scale_fac_uVolts_per_count,
+                 scale_aux=scale_fac_accel_G_per_count, firmware='', radio_channel=0, start_time=0.0):
+        self.filename = filename
+        self.scale_eeg = scale_eeg
+        self.scale_aux = scale_aux
+        self.dtype = record_dtype(n_eeg, n_aux)
+        self.samples_written = 0
+        self._file = open(filename, 'wb')
+        header = _HEADER.pack(MAGIC, VERSION, HEADER_SIZE, sample_rate, n_eeg, n_aux, scale_eeg, scale_aux,
+                              firmware.encode('ascii', 'replace')[:16], radio_channel, start_time)
+        self._file.write(header.ljust(HEADER_SIZE, b'\x00'))
+
+    @classmethod
+    def from_board(cls, filename, board, start_time=0.0):
+        return cls(filename, board.getSampleRate(), board.getNbEEGChannels(), board.getNbAUXChannels(),
+                   firmware=board.openBCIFirmwareVersion, radio_channel=board.radio_channel_number,
+                   start_time=start_time)
+
+    def write(self, ids, channel_data, aux_data, timestamps, scaled=True):
+        """
+        Args:
+          scaled: channel_data and aux_data are in uV and G, as given by a board with scaled_output,
+              rather than raw counts.
+        """
+        records = np.empty(len(ids), dtype=self.dtype)
+        records['id'] = ids
+        records['time'] = timestamps
+        if scaled:
+            records['eeg'] = np.rint(np.asarray(channel_data) / self.scale_eeg)
+            records['aux'] = np.rint(np.asarray(aux_data) / self.scale_aux)
+        else:
+            records['eeg'] = channel_data
+            records['aux'] = aux_data
+        records.tofile(self._file)
+        self.samples_written += len(records)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class Recording(object):
+    """
+    Read-only, memory-mapped view of a recording file. Times are in seconds from the first sample.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            header = f.read(_HEADER.size)
+        (magic, version, header_size, self.sample_rate, self.n_eeg, self.n_aux, self.scale_eeg, self.scale_aux,
+         firmware, self.radio_channel, self.start_time) = _HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError("%s is not a recording file" % filename)
+        if version > VERSION:
+            raise ValueError("%s has format version %d, only up to %d is supported" % (filename, version, VERSION))
+        self.firmware = firmware.rstrip(b'\x00').decode('ascii')
+
+        self.dtype = record_dtype(self.n_eeg, self.n_aux)
+        # a record cut short by a crash is ignored
+        n = (os.path.getsize(filename) - header_size) // self.dtype.itemsize
+        if n > 0:
+            self.records = np.memmap(filename, dtype=self.dtype, mode='r', offset=header_size, shape=(n,))
+        else:
+            self.records = np.empty(0, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def duration(self):
+        return len(self) / self.sample_rate
+
+    def index(self, seconds):
+        """Sample index at a time, clipped to the recording."""
+        if seconds is None:
+            return None
+        return int(min(max(round(seconds * self.sample_rate), 0), len(self)))
+
+    def _window(self, start, stop):
+        return slice(self.index(start), self.index(stop))
+
+    def eeg(self, start=None, stop=None, channels=None, scaled=True):
+        """
+        EEG data from start to stop seconds, (samples, channels) or (samples,) for a single channel.
+        Only that window is read from disk.
+        """
+        counts = self.records['eeg'][self._window(start, stop)]
+        if channels is not None:
+            counts = counts[:, channels]
+        return counts * self.scale_eeg if scaled else np.array(counts)
+
+    def aux(self, start=None, stop=None, channels=None, scaled=True):
+        counts = self.records['aux'][self._window(start, stop)]
+        if channels is not None:
+            counts = counts[:, channels]
+        return counts * self.scale_aux if scaled else np.array(counts)
+
+    def ids(self, start=None, stop=None):
+        return np.array(self.records['id'][self._window(start, stop)])
+
+    def timestamps(self, start=None, stop=None):
+        """Timestamps recorded with each sample."""
+        return np.array(self.records['time'][self._window(start, stop)])
+
+    def times(self, start=None, stop=None):
+        """Nominal time of each sample, from its index and the sample rate."""
+        window = self._window(start, stop)
+        first, last, _ = window.indices(len(self))
+        return np.arange(first, last) / self.sample_rate
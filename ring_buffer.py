@@ -0,0 +1,131 @@
+"""
+Preallocated ring buffer of decoded samples, shared between the thread reading
+the serial port and any number of consumers reading at their own pace.
+EXAMPLE USE:
+ring = board.start_acquisition()
+cursor = 0
+while True:
+    block = ring.wait(cursor, timeout=1)
+    process(block.eeg)
+    cursor = block.cursor
+"""
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+# cursor: where the next read should start, lost: samples overwritten before they were read
+RingBlock = namedtuple('RingBlock', ['ids', 'eeg', 'aux', 'timestamps', 'cursor', 'lost'])
+
+
+class SampleRingBuffer(object):
+    """
+    Fixed size (samples x channels) storage that overwrites the oldest samples when full.
+    Samples are addressed by a cursor, the number of samples written before them, so
+    readers never need to know where the ring wraps.
+    Args:
+      capacity: number of samples kept.
+      n_eeg: EEG channels per sample.
+      n_aux: AUX channels per sample.
+    """
+
+    def __init__(self, capacity, n_eeg, n_aux):
+        self.capacity = int(capacity)
+        self.eeg = np.zeros((self.capacity, n_eeg))
+        self.aux = np.zeros((self.capacity, n_aux))
+        self.ids = np.zeros(self.capacity, dtype=np.int64)
+        self.timestamps = np.zeros(self.capacity)
+        self.total = 0  # samples written since creation
+        # cursor the write in progress ends at, raised before copying: samples below
+        # writing - capacity may be getting overwritten
+        self.writing = 0
+        self.overruns = 0  # samples overwritten before some reader got to them
+        self._lock = threading.Lock()
+        self._new_data = threading.Condition(self._lock)
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def write(self, ids, eeg, aux, timestamps):
+        n = len(ids)
+        if n == 0:
+            return
+        if n > self.capacity:
+            skip = n - self.capacity
+            ids, eeg, aux, timestamps = ids[skip:], eeg[skip:], aux[skip:], timestamps[skip:]
+            with self._lock:
+                self.total += skip
+            n = self.capacity
+
+        with self._lock:
+            self.writing = self.total + n
+        start = self.total % self.capacity
+        first = min(n, self.capacity - start)
+        for dest, src in ((self.ids, ids), (self.eeg, eeg), (self.aux, aux), (self.timestamps, timestamps)):
+            dest[start:start + first] = src[:first]
+            dest[:n - first] = src[first:]
+
+        with self._new_data:
+            self.total += n
+            self._new_data.notify_all()
+
+    def oldest(self):
+        """Cursor of the oldest sample still in the ring and not being overwritten."""
+        return max(0, self.writing - self.capacity)
+
+    def valid(self, cursor):
+        """Whether the samples from cursor on have not been overwritten yet, to check views after using them."""
+        return cursor >= self.oldest()
+
+    def read_since(self, cursor, max_samples=None, copy=False):
+        """
+        Everything written since cursor, as a RingBlock. The arrays are views into the ring
+        unless the range wraps around its end or copy is set; views are only valid until the
+        writer laps them (see valid()). Copies are checked against the writer the same way
+        valid() checks views, once copied: samples overwritten during the copy are dropped from
+        the front of the block and counted in lost.
+        """
+        with self._lock:
+            total = self.total
+            writing = self.writing
+        oldest = max(0, writing - self.capacity)
+        lost = 0
+        if cursor < oldest:
+            lost = oldest - cursor
+            self.overruns += lost
+            cursor = oldest
+        stop = total
+        if max_samples is not None:
+            stop = min(stop, cursor + max_samples)
+
+        start = cursor % self.capacity
+        n = stop - cursor
+        wraps = start + n > self.capacity
+        if not wraps:
+            index = slice(start, start + n)
+            arrays = [a[index] for a in (self.ids, self.eeg, self.aux, self.timestamps)]
+            if copy:
+                arrays = [a.copy() for a in arrays]
+        else:
+            first = self.capacity - start
+            arrays = [np.concatenate((a[start:], a[:n - first]))
+                      for a in (self.ids, self.eeg, self.aux, self.timestamps)]
+
+        if copy or wraps:
+            # the writer may have lapped the copy while it was being taken
+            torn = min(self.oldest(), stop) - cursor
+            if torn > 0:
+                arrays = [a[torn:] for a in arrays]
+                lost += torn
+                self.overruns += torn
+        return RingBlock(*arrays, cursor=stop, lost=lost)
+
+    def latest(self, n, copy=False):
+        """The last n samples written (fewer if the ring holds less)."""
+        return self.read_since(max(self.oldest(), self.total - n), copy=copy)
+
+    def wait(self, cursor, timeout=None, max_samples=None, copy=False):
+        """Like read_since, but blocks until there is something after cursor or timeout expires."""
+        with self._new_data:
+            self._new_data.wait_for(lambda: self.total > cursor, timeout)
+        return self.read_since(cursor, max_samples, copy)
@@ -0,0 +1,295 @@
+"""
+Fan-out of the live stream to other processes through a ring buffer in shared memory.
+One publisher, normally the process owning the OpenBCIBoard, writes decoded blocks; any number
+of subscriber processes attach by name and read NumPy views of the ring, without copies.
+Shared memory layout:
+  Header(64): magic | capacity | EEG channels | AUX channels | sample rate | written | writing
+  ids (capacity, int64) | timestamps (capacity, float64) | EEG (capacity, n_eeg, float64) |
+  AUX (capacity, n_aux, float64)
+"written" is the number of samples published so far. The publisher raises "writing" to the
+cursor its write will end at before copying, and "written" after, so a reader can tell which
+samples may be getting overwritten while it looks at them.
+EXAMPLE USE:
+publisher = SharedStreamPublisher.from_board(board, name='openbci')
+board.start_block_streaming(publisher.publish_block)
+# in another process
+subscriber = SharedStreamSubscriber('openbci')
+while True:
+    block = subscriber.wait(timeout=1)
+    process(block.eeg)
+"""
+import time
+from multiprocessing import parent_process, resource_tracker, shared_memory
+
+import numpy as np
+
+from open_bci_v3 import SAMPLE_RATE
+from ring_buffer import RingBlock
+
+MAGIC = 0x4F42434953484D31  # "OBCISHM1"
+HEADER_DTYPE = np.dtype([('magic', '<u8'), ('capacity', '<i8'), ('n_eeg', '<i8'), ('n_aux', '<i8'),
+                         ('sample_rate', '<f8'), ('written', '<i8'), ('writing', '<i8'), ('reserved', '<i8')])
+
+
+def _layout(capacity, n_eeg, n_aux):
+    """Offsets of the arrays and total size in bytes."""
+    offsets = {}
+    offset = HEADER_DTYPE.itemsize
+    for name, row_bytes in (('ids', 8), ('timestamps', 8), ('eeg', 8 * n_eeg), ('aux', 8 * n_aux)):
+        offsets[name] = offset
+        offset += capacity * row_bytes
+    return offsets, offset
+
+
+class _SharedRing(object):
+    """Views of the header and arrays of a shared ring."""
+
+    def _map(self, shm, capacity, n_eeg, n_aux):
+        offsets, _ = _layout(capacity, n_eeg, n_aux)
+        self.header = np.ndarray((), dtype=HEADER_DTYPE, buffer=shm.buf)
+        self.ids = np.ndarray((capacity,), dtype='<i8', buffer=shm.buf, offset=offsets['ids'])
+        self.timestamps = np.ndarray((capacity,), dtype='<f8', buffer=shm.buf, offset=offsets['timestamps'])
+        self.eeg = np.ndarray((capacity, n_eeg), dtype='<f8', buffer=shm.buf, offset=offsets['eeg'])
+        self.aux = np.ndarray((capacity, n_aux), dtype='<f8', buffer=shm.buf, offset=offsets['aux'])
+        self.capacity = capacity
+
+    def _release(self):
+        # the views must go before the shared memory can be closed
+        self.header = self.ids = self.timestamps = self.eeg = self.aux = None
+
+    @property
+    def total(self):
+        return int(self.header['written'])
+
+
+class SharedStreamPublisher(_SharedRing):
+    """
+    Creates the shared ring and writes to it. Only one publisher may write to a ring.
+    Args:
+      name: shared memory name subscribers attach to, a random one if None (see .name).
+      capacity: samples kept before the oldest are overwritten.
+      n_eeg, n_aux: channels per sample.
+      sample_rate: stored in the header for the subscribers.
+    """
+
+    def __init__(self, name=None, capacity=int(SAMPLE_RATE * 60), n_eeg=8, n_aux=3, sample_rate=SAMPLE_RATE):
+        _, size = _layout(capacity, n_eeg, n_aux)
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self._map(self.shm, capacity, n_eeg, n_aux)
+        self.header['capacity'] = capacity
+        self.header['n_eeg'] = n_eeg
+        self.header['n_aux'] = n_aux
+        self.header['sample_rate'] = sample_rate
+        self.header['written'] = 0
+        self.header['writing'] = 0
+        # written last, subscribers check it to know the header is complete
+        self.header['magic'] = MAGIC
+
+    @classmethod
+    def from_board(cls, board, name=None, capacity=int(SAMPLE_RATE * 60)):
+        return cls(name, capacity, board.getNbEEGChannels(), board.getNbAUXChannels(), board.getSampleRate())
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, ids, eeg, aux, timestamps):
+        n = len(ids)
+        if n == 0:
+            return
+        total = self.total
+        if n > self.capacity:
+            skip = n - self.capacity
+            ids, eeg, aux, timestamps = ids[skip:], eeg[skip:], aux[skip:], timestamps[skip:]
+            total += skip
+            n = self.capacity
+
+        self.header['writing'] = total + n
+        start = total % self.capacity
+        first = min(n, self.capacity - start)
+        for dest, src in ((self.ids, ids), (self.eeg, eeg), (self.aux, aux), (self.timestamps, timestamps)):
+            dest[start:start + first] = src[:first]
+            dest[:n - first] = src[first:]
+        self.header['written'] = total + n
+
+    def publish_block(self, channel_data, aux_data, ids, timestamps):
+        """start_block_streaming callback."""
+        self.write(ids, channel_data, aux_data, timestamps)
+
+    def close(self):
+        """Remove the shared memory; subscribers still attached keep their mapping until they close."""
+        self._release()
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        # the publisher owns the memory, this process' tracker would unlink it when it exits;
+        # processes started by multiprocessing share their parent's tracker and must leave it alone
+        if parent_process() is None:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class SharedStreamSubscriber(_SharedRing):
+    """
+    Reader of a shared ring, with its own cursor. Blocks are views into the shared memory unless
+    the range wraps around the end of the ring; they stay valid until the publisher laps them,
+    which valid() checks.
+    Args:
+      name: name of the publisher's shared memory.
+      start: 'latest' to read only what is published from now on, 'oldest' to start with
+          everything still in the ring.
+    """
+
+    def __init__(self, name, start='latest'):
+        self.shm = _attach(name)
+        header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self.shm.buf)
+        if int(header['magic']) != MAGIC:
+            raise ValueError("%s is not a shared EEG stream" % name)
+        capacity, n_eeg, n_aux = int(header['capacity']), int(header['n_eeg']), int(header['n_aux'])
+        del header
+        self._map(self.shm, capacity, n_eeg, n_aux)
+        self.sample_rate = float(self.header['sample_rate'])
+        self.n_eeg = n_eeg
+        self.n_aux = n_aux
+        self.cursor = self.total if start == 'latest' else self.oldest()
+        self.lost = 0  # samples overwritten before this subscriber read them
+        self.overruns = 0  # reads that found samples lost
+
+    def oldest(self):
+        """Cursor of the oldest sample that is not being overwritten."""
+        return max(0, int(self.header['writing']) - self.capacity)
+
+    def valid(self, cursor):
+        """Whether the samples from cursor on have not been overwritten yet, to check views after using them."""
+        return cursor >= self.oldest()
+
+    @property
+    def lag(self):
+        """Samples published but not read yet."""
+        return self.total - self.cursor
+
+    def read(self, max_samples=None, copy=False):
+        """Everything published since the last read, as a ring_buffer.RingBlock."""
+        total = self.total
+        oldest = self.oldest()
+        cursor = self.cursor
+        lost = 0
+        if cursor < oldest:
+            lost = oldest - cursor
+            self.lost += lost
+            self.overruns += 1
+            cursor = oldest
+        stop = total if max_samples is None else min(total, cursor + max_samples)
+        stop = max(stop, cursor)
+
+        start = cursor % self.capacity
+        n = stop - cursor
+        if start + n <= self.capacity:
+            index = slice(start, start + n)
+            arrays = [a[index] for a in (self.ids, self.eeg, self.aux, self.timestamps)]
+            if copy:
+                arrays = [a.copy() for a in arrays]
+        else:
+            first = self.capacity - start
+            arrays = [np.concatenate((a[start:], a[:n - first]))
+                      for a in (self.ids, self.eeg, self.aux, self.timestamps)]
+        self.cursor = stop
+        return RingBlock(*arrays, cursor=stop, lost=lost)
+
+    def wait(self, timeout=None, max_samples=None, copy=False, poll=0.001):
+        """Like read, but first waits until something new is published or timeout expires."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.total <= self.cursor:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            time.sleep(poll)
+        return self.read(max_samples, copy)
+
+    def close(self):
+        self._release()
+        self.shm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _subscriber_benchmark(name, results, seconds):
+    subscriber = SharedStreamSubscriber(name, start='oldest')
+    reads = samples = 0
+    busy = 0.0
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        if subscriber.lag == 0:
+            time.sleep(0.001)
+            continue
+        start = time.perf_counter()
+        block = subscriber.read()
+        # touch the data, as a real consumer would
+        block.eeg.sum()
+        busy += time.perf_counter() - start
+        reads += 1
+        samples += len(block.ids)
+    results.put((reads, samples, busy, subscriber.lost))
+    subscriber.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import multiprocessing
+
+    parser = argparse.ArgumentParser(description="Cost per subscriber as subscribers are added.")
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--rate', type=float, default=SAMPLE_RATE * 10, help="samples per second published")
+    parser.add_argument('--channels', type=int, default=16)
+    args = parser.parse_args()
+
+    block = 25
+    rng = np.random.default_rng(0)
+    eeg = rng.normal(0, 10, (block, args.channels))
+    aux = np.zeros((block, 3))
+    for n_subscribers in (1, 2, 4, 8):
+        with SharedStreamPublisher(capacity=int(args.rate * 2), n_eeg=args.channels) as publisher:
+            results = multiprocessing.Queue()
+            processes = [multiprocessing.Process(target=_subscriber_benchmark,
+                                                 args=(publisher.name, results, args.seconds + 0.5))
+                         for _ in range(n_subscribers)]
+            for p in processes:
+                p.start()
+            time.sleep(0.2)
+
+            published = 0
+            write_time = 0.0
+            start = time.monotonic()
+            while time.monotonic() - start < args.seconds:
+                due = int((time.monotonic() - start) * args.rate) - published
+                if due < block:
+                    time.sleep(block / args.rate / 2)
+                    continue
+                t = time.perf_counter()
+                publisher.write(np.arange(published, published + block), eeg, aux, np.full(block, time.time()))
+                write_time += time.perf_counter() - t
+                published += block
+
+            stats = [results.get() for _ in processes]
+            for p in processes:
+                p.join()
+        reads = sum(s[0] for s in stats)
+        print("%d subscriber(s): publish %.1f us/block, read %.1f us/block per subscriber, "
+              "%d/%d samples received each, %d lost"
+              % (n_subscribers, write_time / (published / block) * 1e6, sum(s[2] for s in stats) / reads * 1e6,
+                 min(s[1] for s in stats), published, sum(s[3] for s in stats)))
@@ -0,0 +1,169 @@
+"""
+Incremental Welch PSD / STFT for live blocks and for long recordings read chunk by chunk.
+EXAMPLE USE:
+engine = SpectralEngine(fs=250.0, nperseg=256)
+board.start_block_streaming(engine.block_callback(), block_size=25)
+freqs, psd = engine.freqs, engine.psd()  # Welch average of the last frames, (freqs, channels)
+"""
+import timeit
+from collections import deque
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.fft import rfft, rfftfreq
+from scipy.signal import get_window
+
+
+class SpectralEngine(object):
+    """
+    Sliding-window spectra of every channel. New frames are computed only for the segments
+    completed by each block, all channels and frames in one multi-worker rfft call.
+    Args:
+      fs: sampling frequency.
+      nperseg: samples per segment.
+      noverlap: samples shared by consecutive segments, nperseg // 2 by default.
+      window: window name or array, as for scipy.signal.get_window.
+      average: number of most recent frames in the Welch average, None to average every frame.
+      workers: scipy.fft workers, -1 for all cores.
+    """
+
+    def __init__(self, fs, nperseg=256, noverlap=None, window='hann', average=8, workers=-1):
+        self.fs = float(fs)
+        self.nperseg = nperseg
+        self.noverlap = nperseg // 2 if noverlap is None else noverlap
+        self.step = nperseg - self.noverlap
+        self.window = get_window(window, nperseg) if isinstance(window, str) else np.asarray(window)
+        self.workers = workers
+        self.freqs = rfftfreq(nperseg, 1.0 / self.fs)
+
+        # one-sided density scaling, as scipy.signal.welch(scaling='density')
+        self.scale = np.full(len(self.freqs), 2.0 / (self.fs * np.sum(self.window ** 2)))
+        self.scale[0] /= 2
+        if nperseg % 2 == 0:
+            self.scale[-1] /= 2
+
+        self.average = average
+        self.reset()
+
+    def reset(self):
+        self._tail = None  # samples not yet covered by a full segment
+        self._next_start = 0  # index of the first sample of the next segment
+        self._psd_sum = None
+        self._frames = deque()
+        self.frames_seen = 0
+
+    def update(self, block):
+        """
+        Args:
+          block: (n_samples, n_channels) array.
+        Returns:
+          times of the new frames (centre of each segment, seconds from the first sample) and
+          their power spectral density, (n_frames, n_freqs, n_channels).
+        """
+        block = np.asarray(block, dtype=float)
+        if block.ndim == 1:
+            block = block[:, None]
+        data = block if self._tail is None else np.concatenate((self._tail, block))
+        # index of data[0] in the whole stream
+        offset = self._next_start if self._tail is not None else 0
+
+        n_frames = 0 if len(data) < self.nperseg else (len(data) - self.nperseg) // self.step + 1
+        if n_frames:
+            segments = sliding_window_view(data, self.nperseg, axis=0)[::self.step][:n_frames]
+            # (frames, channels, nperseg)
+            segments = segments - segments.mean(axis=-1, keepdims=True)
+            spectrum = rfft(segments * self.window, axis=-1, workers=self.workers)
+            frames = (spectrum.real ** 2 + spectrum.imag ** 2) * self.scale
+            frames = frames.transpose(0, 2, 1)
+        else:
+            frames = np.empty((0, len(self.freqs), data.shape[1]))
+
+        starts = offset + np.arange(n_frames) * self.step
+        times = (starts + self.nperseg / 2.0) / self.fs
+        consumed = n_frames * self.step
+        self._tail = data[consumed:]
+        self._next_start = offset + consumed
+
+        self._accumulate(frames)
+        return times, frames
+
+    def _accumulate(self, frames):
+        if not len(frames):
+            return
+        if self._psd_sum is None:
+            self._psd_sum = np.zeros(frames.shape[1:])
+        self._psd_sum += frames.sum(axis=0)
+        self.frames_seen += len(frames)
+        if self.average is not None:
+            self._frames.extend(frames)
+            while len(self._frames) > self.average:
+                self._psd_sum -= self._frames.popleft()
+
+    def psd(self):
+        """Welch average over the last frames, (n_freqs, n_channels), None before the first full segment."""
+        if self._psd_sum is None:
+            return None
+        n = self.frames_seen if self.average is None else len(self._frames)
+        return self._psd_sum / n
+
+    def block_callback(self, callback=None):
+        """start_block_streaming callback updating the engine; callback, if given, gets (times, frames)."""
+        def call(channel_data, aux_data, ids, timestamps):
+            times, frames = self.update(channel_data)
+            if callback is not None and len(frames):
+                callback(times, frames)
+        return call
+
+
+def spectrogram_chunks(source, fs, chunk_samples=250 * 60, channels=None, **engine_args):
+    """
+    Spectrogram of a long recording, chunk by chunk, with memory bounded by the chunk size.
+    Args:
+      source: (n_samples, n_channels) array-like read lazily, e.g. a np.memmap, or a recording.Recording.
+      chunk_samples: samples read per chunk.
+      channels: channels to use, all by default.
+      engine_args: SpectralEngine settings.
+    Yields:
+      (times, frames) for the frames completed by each chunk.
+    """
+    engine = SpectralEngine(fs, average=None, **engine_args)
+    n = len(source)
+    for start in range(0, n, chunk_samples):
+        stop = min(start + chunk_samples, n)
+        if hasattr(source, 'eeg'):
+            chunk = source.eeg(start / source.sample_rate, stop / source.sample_rate, channels)
+        else:
+            chunk = source[start:stop] if channels is None else source[start:stop, channels]
+        times, frames = engine.update(chunk)
+        if len(frames):
+            yield times, frames
+
+
+if __name__ == "__main__":
+    from scipy.signal import welch
+
+    fs = 250.0
+    rng = np.random.default_rng(0)
+    t = np.arange(int(fs * 60)) / fs
+    data = 10 * np.sin(2 * np.pi * 10 * t)[:, None] + rng.normal(0, 5, (len(t), 16))
+
+    engine = SpectralEngine(fs, nperseg=256, average=None)
+    for i in range(0, len(data), 25):
+        engine.update(data[i:i + 25])
+    freqs, reference = welch(data, fs, nperseg=256, axis=0)
+    print("Incremental Welch vs scipy.signal.welch, max relative error: %.2e"
+          % (np.abs(engine.psd() - reference).max() / reference.max()))
+
+    hours = 1
+    long_data = rng.normal(0, 5, (int(fs * 3600 * hours), 16)).astype(np.float32)
+    start = timeit.default_timer()
+    n_frames = sum(len(frames) for _, frames in spectrogram_chunks(long_data, fs, chunk_samples=250 * 60))
+    elapsed = timeit.default_timer() - start
+    print("Spectrogram of %d h x 16 channels in 1 min chunks: %d frames in %.2f s" % (hours, n_frames, elapsed))
+
+    live = SpectralEngine(fs)
+    start = timeit.default_timer()
+    for i in range(0, len(long_data) // 6, 25):
+        live.update(long_data[i:i + 25])
+    elapsed = timeit.default_timer() - start
+    print("Live updates, 16 channels in blocks of 25: %.0fx real time" % (len(long_data) / 6 / fs / elapsed))
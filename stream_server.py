@@ -0,0 +1,370 @@
+"""
+Broadcast of the decoded stream to any number of TCP clients, plus the client library.
+The server runs its asyncio loop on a thread of its own and is fed from the board's callbacks;
+every block is encoded once and queued to each client, and a client that falls behind loses
+its oldest blocks (or is disconnected), never slowing down the acquisition.
+Protocol (little endian):
+  On connect: magic "OBCISTRM" | version(2) | encoding(1): 0 float32, 1 int24 | EEG channels(2) |
+              AUX channels(2) | sample rate(8) | uV per count(8) | G per count(8)
+  Per block:  samples dropped for this client since its last block(4) | payload size(4) |
+              samples(2) | sequence number of the first sample(8) | timestamp of the first sample(8) |
+              ids (samples x uint8) | EEG | AUX
+  EEG and AUX are float32 (uV, G), or with int24 EEG as 3-byte big endian counts and AUX as int16 counts.
+EXAMPLE USE:
+server = StreamServer.from_board(board, port=8765).start()
+board.start_block_streaming(server.publish_block)
+# elsewhere
+with StreamClient('localhost', 8765) as client:
+    for block in client:
+        print(block.channel_data.shape)
+"""
+import asyncio
+import socket
+import struct
+import threading
+
+import numpy as np
+
+from open_bci_v3 import SAMPLE_RATE, SampleBatch, scale_fac_uVolts_per_count, scale_fac_accel_G_per_count
+
+MAGIC = b'OBCISTRM'
+VERSION = 1
+ENCODINGS = {'float32': 0, 'int24': 1}
+_HELLO = struct.Struct('<8sHBHHddd')
+_CLIENT_PREFIX = struct.Struct('<II')  # dropped samples, payload size
+_BLOCK = struct.Struct('<Hqd')
+
+
+def encode_int24(counts):
+    """(N, channels) integer counts as (N, channels * 3) big endian bytes."""
+    counts = np.clip(counts, -2 ** 23, 2 ** 23 - 1).astype('>i4')
+    return counts.view(np.uint8).reshape(counts.shape + (4,))[..., 1:]
+
+
+def decode_int24(data, n, channels):
+    raw = np.frombuffer(data, dtype=np.uint8).reshape(n, channels, 3).astype(np.int32)
+    values = (raw[..., 0] << 16) | (raw[..., 1] << 8) | raw[..., 2]
+    return np.where(values >= 2 ** 23, values - 2 ** 24, values)
+
+
+class _Client(object):
+    __slots__ = ('writer', 'queue', 'dropped', 'task')
+
+    def __init__(self, writer, queue_size):
+        self.writer = writer
+        self.queue = asyncio.Queue(queue_size)
+        self.dropped = 0
+        self.task = None
+
+
+class StreamServer(object):
+    """
+    Args:
+      host, port: where to listen; port 0 picks a free one (see .port after start()).
+      n_eeg, n_aux, sample_rate: stream layout, sent to every client on connect.
+      encoding: 'float32' or 'int24', the board's own resolution in a quarter less bytes.
+      queue_size: blocks kept for a client that is not reading fast enough.
+      policy: 'drop_oldest' to drop that client's oldest block when its queue is full, telling it
+          how many samples it missed, or 'disconnect' to close the connection.
+      scaled: the blocks published are in uV and G, as from a board with scaled_output.
+      send_buffer: socket send buffer per client in bytes, the system's default if None. The kernel
+          buffers can hold seconds of stream on their own before the queue starts filling up.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, n_eeg=8, n_aux=3, sample_rate=SAMPLE_RATE, encoding='float32',
+                 queue_size=64, policy='drop_oldest', scaled=True, send_buffer=None):
+        if encoding not in ENCODINGS:
+            raise ValueError("encoding must be one of %s, not %r" % (tuple(ENCODINGS), encoding))
+        if policy not in ('drop_oldest', 'disconnect'):
+            raise ValueError("policy must be 'drop_oldest' or 'disconnect', not %r" % policy)
+        self.host = host
+        self.port = port
+        self.n_eeg = n_eeg
+        self.n_aux = n_aux
+        self.sample_rate = sample_rate
+        self.encoding = encoding
+        self.queue_size = queue_size
+        self.policy = policy
+        self.scaled = scaled
+        self.send_buffer = send_buffer
+        self.clients = set()
+        self.sequence = 0  # samples published so far
+        self.dropped = 0  # samples dropped by the drop_oldest policy, all clients together
+        self.disconnected = 0  # clients dropped by the disconnect policy
+        self._hello = _HELLO.pack(MAGIC, VERSION, ENCODINGS[encoding], n_eeg, n_aux, sample_rate,
+                                  scale_fac_uVolts_per_count, scale_fac_accel_G_per_count)
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._started = threading.Event()
+        self._pending = []  # samples from sample_callback not published yet
+
+    @classmethod
+    def from_board(cls, board, **kwargs):
+        return cls(n_eeg=board.getNbEEGChannels(), n_aux=board.getNbAUXChannels(),
+                   sample_rate=board.getSampleRate(), scaled=board.scaling_output, **kwargs)
+
+    """
+        SERVER
+    """
+
+    def start(self):
+        """Start listening on a background thread; returns once the port is open."""
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle_client, self.host, self.port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._started.set()
+        self._loop.run_forever()
+        self._loop.close()
+
+    async def _handle_client(self, reader, writer):
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self.send_buffer:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer)
+        # drain() waits until the socket took everything, so the backlog stays in the client's queue
+        writer.transport.set_write_buffer_limits(0)
+        client = _Client(writer, self.queue_size)
+        client.task = asyncio.current_task()
+        self.clients.add(client)
+        try:
+            writer.write(self._hello)
+            await writer.drain()
+            while True:
+                frame, n = await client.queue.get()
+                writer.write(_CLIENT_PREFIX.pack(client.dropped, len(frame)))
+                writer.write(frame)
+                client.dropped = 0
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.clients.discard(client)
+            writer.close()
+
+    def _broadcast(self, frame, n):
+        # runs on the server loop
+        for client in list(self.clients):
+            if client.queue.full():
+                if self.policy == 'disconnect':
+                    self.clients.discard(client)
+                    self.disconnected += 1
+                    client.task.cancel()
+                    continue
+                _, lost = client.queue.get_nowait()
+                client.dropped += lost
+                self.dropped += lost
+            client.queue.put_nowait((frame, n))
+
+    def stop(self):
+        if self._loop is None:
+            return
+
+        async def shutdown():
+            self._server.close()
+            for client in list(self.clients):
+                client.task.cancel()
+            await self._server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    """
+        PUBLISHING
+        Called from the acquisition thread.
+    """
+
+    def encode(self, ids, channel_data, aux_data, timestamps):
+        n = len(ids)
+        header = _BLOCK.pack(n, self.sequence, timestamps[0])
+        ids = (np.asarray(ids) % 256).astype(np.uint8)
+        if self.encoding == 'float32':
+            eeg = np.ascontiguousarray(channel_data, dtype='<f4')
+            aux = np.ascontiguousarray(aux_data, dtype='<f4')
+        else:
+            eeg_counts = np.asarray(channel_data)
+            aux_counts = np.asarray(aux_data)
+            if self.scaled:
+                eeg_counts = np.rint(eeg_counts / scale_fac_uVolts_per_count)
+                aux_counts = np.rint(aux_counts / scale_fac_accel_G_per_count)
+            eeg = np.ascontiguousarray(encode_int24(eeg_counts.astype(np.int64)))
+            aux = np.clip(aux_counts, -2 ** 15, 2 ** 15 - 1).astype('<i2')
+        return b''.join((header, ids.tobytes(), eeg.tobytes(), aux.tobytes()))
+
+    def publish_block(self, channel_data, aux_data, ids, timestamps):
+        """start_block_streaming callback."""
+        n = len(ids)
+        if not n or self._loop is None:
+            return
+        frame = self.encode(ids, channel_data, aux_data, timestamps)
+        self.sequence += n
+        self._loop.call_soon_threadsafe(self._broadcast, frame, n)
+
+    def sample_callback(self, block_size=25):
+        """start_streaming callback, sending the samples in blocks of block_size."""
+        def call(sample):
+            self._pending.append(sample)
+            if len(self._pending) >= block_size:
+                batch = SampleBatch.from_samples(self._pending, self.n_eeg, self.n_aux)
+                self._pending = []
+                self.publish_block(batch.channel_data, batch.aux_data, batch.ids, batch.time)
+        return call
+
+
+class StreamClient(object):
+    """
+    Blocking client of a StreamServer. Iterating gives one open_bci_v3.SampleBatch per block, in
+    uV and G, until the server closes the connection.
+
+    Args:
+      host, port: the server.
+      timeout: seconds to wait for the connection and for each read, None to wait forever.
+      recv_buffer: socket receive buffer in bytes, the system's default if None. A small one makes
+          the server notice sooner that this client is falling behind.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8765, timeout=None, recv_buffer=None):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if recv_buffer:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, recv_buffer)
+        self.sock.settimeout(timeout)
+        self.sock.connect((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self.sock.makefile('rb')
+        (magic, version, encoding, self.n_eeg, self.n_aux, self.sample_rate, self.scale_eeg,
+         self.scale_aux) = _HELLO.unpack(self._read(_HELLO.size))
+        if magic != MAGIC:
+            raise ValueError("%s:%d is not an OpenBCI stream server" % (host, port))
+        if version > VERSION:
+            raise ValueError("Server protocol version %d, only up to %d is supported" % (version, VERSION))
+        self.encoding = {v: k for k, v in ENCODINGS.items()}[encoding]
+        self.dropped = 0  # samples the server dropped for this client
+        self.sequence = None  # sequence number of the next sample expected
+
+    def _read(self, size):
+        data = self._file.read(size)
+        if len(data) < size:
+            raise EOFError("Connection closed by the server")
+        return data
+
+    def read_block(self):
+        """The next block, or None when the server closed the connection."""
+        try:
+            dropped, size = _CLIENT_PREFIX.unpack(self._read(_CLIENT_PREFIX.size))
+            payload = self._read(size)
+        except EOFError:
+            return None
+        self.dropped += dropped
+        n, sequence, t0 = _BLOCK.unpack_from(payload)
+        self.sequence = sequence + n
+        offset = _BLOCK.size
+        ids = np.frombuffer(payload, dtype=np.uint8, count=n, offset=offset).astype(np.int64)
+        offset += n
+        if self.encoding == 'float32':
+            eeg = np.frombuffer(payload, dtype='<f4', count=n * self.n_eeg, offset=offset).reshape(n, self.n_eeg)
+            offset += eeg.nbytes
+            aux = np.frombuffer(payload, dtype='<f4', count=n * self.n_aux, offset=offset).reshape(n, self.n_aux)
+        else:
+            size = n * self.n_eeg * 3
+            eeg = decode_int24(payload[offset:offset + size], n, self.n_eeg) * self.scale_eeg
+            offset += size
+            aux = np.frombuffer(payload, dtype='<i2', count=n * self.n_aux, offset=offset).reshape(n, self.n_aux)
+            aux = aux * self.scale_aux
+        timestamps = t0 + np.arange(n) / self.sample_rate
+        return SampleBatch(ids, eeg, aux, timestamps)
+
+    def __iter__(self):
+        while True:
+            block = self.read_block()
+            if block is None:
+                return
+            yield block
+
+    def close(self):
+        self._file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _count_blocks(client, seconds, results, index, delay=0.0):
+    import time
+    received = 0
+    end = time.monotonic() + seconds
+    for block in client:
+        received += len(block)
+        if delay:
+            time.sleep(delay)
+        if time.monotonic() > end:
+            break
+    results[index] = (received, client.dropped)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from cyton_emulator import CytonEmulator
+    from open_bci_v3 import OpenBCIBoard
+
+    parser = argparse.ArgumentParser(description="Stream from the Cyton emulator to local TCP clients.")
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=4)
+    parser.add_argument('--rate', type=float, default=SAMPLE_RATE * 10)
+    parser.add_argument('--encoding', default='float32', choices=tuple(ENCODINGS))
+    args = parser.parse_args()
+
+    with CytonEmulator(sample_rate=args.rate) as emulator:
+        board = OpenBCIBoard(port=emulator.port, log=False, fast_connect=True)
+        with StreamServer.from_board(board, encoding=args.encoding, queue_size=8,
+                                   send_buffer=16384) as server:
+            clients = [StreamClient('127.0.0.1', server.port) for _ in range(args.clients)]
+            clients.append(StreamClient('127.0.0.1', server.port, recv_buffer=4096))
+            results = [None] * len(clients)
+            # the last client reads slowly and should lose blocks without holding the others back
+            threads = [threading.Thread(target=_count_blocks, args=(client, args.seconds, results, i,
+                                                                    0.05 if i == args.clients else 0.0))
+                       for i, client in enumerate(clients)]
+            for thread in threads:
+                thread.start()
+            start = time.monotonic()
+            board.start_block_streaming(server.publish_block, block_size=25, lapse=args.seconds + 0.5)
+            if board.checktimer:
+                board.checktimer.cancel()
+            elapsed = time.monotonic() - start
+            for thread in threads:
+                thread.join()
+            published = server.sequence
+            dropped = server.dropped
+            for client in clients:
+                client.close()
+        board.disconnect()
+
+    frame_bytes = _CLIENT_PREFIX.size + _BLOCK.size + 25 * (1 + (4 if args.encoding == 'float32' else 3) * 8
+                                                          + (4 if args.encoding == 'float32' else 2) * 3)
+    print("Published %d samples in %.1f s (%.0f samples/s), %d bytes per block of 25, %s"
+          % (published, elapsed, published / elapsed, frame_bytes, args.encoding))
+    print("Server dropped %d samples in total" % dropped)
+    for i, (received, dropped) in enumerate(results):
+        print("  client %d%s: received %d samples, server dropped %d"
+              % (i, " (slow)" if i == args.clients else "", received, dropped))
@@ -0,0 +1,72 @@
+"""
+Connection supervisor of a streaming OpenBCIBoard: a single thread watching data arrival and
+dropped packets, replacing the chain of threading.Timer that check_connection used to start.
+EXAMPLE USE:
+board.start_streaming(handle_sample)  # starts board.supervisor
+...
+print(board.supervisor.recovery_times)  # seconds each reconnection took
+"""
+import threading
+import timeit
+
+
+class ConnectionSupervisor(threading.Thread):
+    """
+    Ask the board to reconnect when no data has arrived for stall_timeout seconds, or when more
+    than max_packets_to_skip packets in a row were bad. The reconnection itself runs on the
+    streaming thread between two reads (see OpenBCIBoard.request_reconnect), so stream loops are
+    never nested; it retries with exponential backoff.
+    Args:
+      board: the OpenBCIBoard to watch.
+      interval: seconds between checks of the dropped packets.
+      max_packets_to_skip: bad packets in a row tolerated.
+      stall_timeout: seconds without data that count as a lost connection, interval by default.
+      backoff_initial: seconds between the first two reconnection attempts, doubled after each one.
+      backoff_max: longest wait between attempts.
+      max_attempts: attempts before giving up and stopping the stream, None to keep trying.
+    """
+
+    def __init__(self, board, interval=2.0, max_packets_to_skip=10, stall_timeout=None,
+                 backoff_initial=0.5, backoff_max=30.0, max_attempts=None):
+        super().__init__(daemon=True)
+        self.board = board
+        self.interval = interval
+        self.max_packets_to_skip = max_packets_to_skip
+        self.stall_timeout = interval if stall_timeout is None else stall_timeout
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.max_attempts = max_attempts
+        self.poll = min(interval, self.stall_timeout / 4.0)
+        self.recovery_times = []  # seconds from detection to data flowing again, per reconnection
+        self.failed_attempts = 0
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """Stop supervising, as threading.Timer.cancel() did for the old check_connection."""
+        self._cancelled.set()
+
+    def run(self):
+        board = self.board
+        while not self._cancelled.wait(self.poll):
+            if not board.streaming:
+                break
+            if board.reconnecting:
+                continue
+            silent = timeit.default_timer() - board.last_data_time
+            if silent > self.stall_timeout:
+                board.warn('No data for %.1f s, reconnecting' % silent)
+                board.request_reconnect()
+            elif board.packets_dropped > self.max_packets_to_skip:
+                board.warn('%d packets dropped, reconnecting' % board.packets_dropped)
+                board.request_reconnect()
+
+    def backoff(self):
+        """Waits between reconnection attempts: backoff_initial, doubled each time, up to backoff_max."""
+        delay = self.backoff_initial
+        while True:
+            yield delay
+            delay = min(delay * 2, self.backoff_max)
@@ -0,0 +1,34 @@
+import numpy as np
+
+from cyton_emulator import encode_packets
+from open_bci_v3 import PACKET_SIZE, START_BYTE, find_packets
+
+
+def _stream(n):
+    ids = np.arange(n)
+    channels = np.zeros((n, 8), dtype=np.int64)
+    aux = np.zeros((n, 3), dtype=np.int64)
+    return encode_packets(ids, channels, aux)
+
+
+def test_corrupted_packet_with_start_bytes_in_payload_counts_once():
+    packets = _stream(6)
+    # packet 2 loses its end byte and carries several START_BYTEs in its payload
+    packets[2, [5, 11, 20, 27]] = START_BYTE
+    packets[2, PACKET_SIZE - 1] = 0x00
+    buf = packets.reshape(-1)
+
+    starts, bad = find_packets(buf)
+
+    assert starts.tolist() == [0, 33, 99, 132, 165]
+    assert bad.tolist() == [66]
+
+
+def test_misaligned_garbage_full_of_start_bytes():
+    garbage = np.full(3 * PACKET_SIZE, START_BYTE, dtype=np.uint8)
+    buf = np.concatenate((garbage, _stream(2).reshape(-1)))
+
+    starts, bad = find_packets(buf)
+
+    assert starts.tolist() == [3 * PACKET_SIZE, 4 * PACKET_SIZE]
+    assert len(bad) == 3
@@ -10,19 +10,21 @@
 #import serial
 #import time
 
-import csv
 import traceback
 import ast
 import time
 import numpy as np
-import pandas as pd
 from scipy.fft import rfft, rfftfreq
 from matplotlib import pyplot as plt
 from Plotter import Plotter
 from open_bci_v3 import OpenBCIBoard
 from scipy.signal import butter, lfilter, iirnotch, filtfilt
 
-from Fps import Fps
+from metrics import StreamMetrics
+from filters import StreamingFilter, bandpass_sos
+from recorder import Recorder
+from csv_loader import load_signal
+from lod_plot import LODPlot
 
 ############################################################################################################
 # imported method from python_scientific.signalfeatures
@@ -53,40 +55,33 @@ def butter_bandpass_filter(data, lowcut, highcut, fs, order=5):
     y = lfilter(b,a,data)
     return y
 
-ffps = Fps()
-ffps.tic()
-
-def create_csv(csv_filename):
-    """Crea el archivo CSV con los encabezados adecuados."""
-    with open(csv_filename, mode='w', newline='') as f:
-        if f.tell() == 0:  # Solo escribe el encabezado si el archivo está vacío
-            writer = csv.writer(f)
-            writer.writerow(["Repetition", "Sample Value Filtered", "FPS"])
-
+# muestras/s, intervalos entre muestras (p50/p99/máx) y bytes/s del puerto
+metrics = StreamMetrics(expected_rate=250.0)
 
 def handle_sample(sample):
 
     #csv_filename = 'sample.csv'
     global repetitions
-    ffps.steptoc()
+    metrics.tick()
 
     sample_value = sample.channel_data[2]  # Extraer el dato relevante
     #sample_value_filtered = butter_bandpass_filter(sample_value, lowcut, highcut, fs)
-    sample_value_filtered = butter_bandpass_filter(np.array([sample_value]), lowcut, highcut, fs)
+    sample.channel_data = alpha_filter.process(sample.channel_data).tolist()
+    sample.filtered = 1
+    sample_value_filtered = sample.channel_data[2]
 
-    fps_value = ffps.fps  # Calcular FPS estimado
+    fps_value = metrics.rate()  # muestras/s en la ventana
 
     #print( f"Estimated frames per second: {ffps.fps} - Sample: {sample.channel_data[2]} ")
     print(f"Estimated FPS: {fps_value:.2f} - - Sample: {sample_value} - Sample (Filtered): {sample_value_filtered}")
 
     # Guardar en CSV
-    with open(csv_filename, mode='a', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow([repetitions, sample_value_filtered, fps_value])
+    recorder.record(sample)
 
     repetitions += 1
     if repetitions >= 2500:
         print("Se alcanzó el límite de muestras [10segs], cerrando...")
+        recorder.close()
         #plot the file 'sample.csv'
         plot_from_csv(csv_filename)
         transformada_fourier(csv_filename)
@@ -95,34 +90,18 @@ def handle_sample(sample):
 
 def plot_from_csv(csv_filename):
     print("Plotting from CSV file...")
-    tiempos = []
-    muestras = []
 
     #csv_filename = 'samples_test/sample.csv'
 
     fs = 250  # Frecuencia de muestreo (250 muestras por segundo)
-    dt = 1 / fs  # Intervalo de tiempo entre muestras
-
-    # Leer el archivo CSV
-    with open(csv_filename, newline='') as csvfile:
-        reader = csv.reader(csvfile)
-        next(reader)  # Saltar el encabezado
-
-        for row in reader:
-            repetition = int(row[0])
-            #sample_value = float(row[1])
-            # Para convertir el string de lista en un array de verdad
-            sample_value = float(row[1].strip('[]'))  # Eliminar corchetes y convertir a float
 
-            # Convertir la repetición a tiempo (segundos)
-            time_sec = repetition * dt
+    # Leer el archivo CSV (también los valores guardados como "[x]")
+    repetitions, muestras, tiempos = load_signal(csv_filename, fs, skip_negative=False)
 
-            tiempos.append(time_sec)
-            muestras.append(sample_value)
-
-    # Graficar
+    # Graficar con nivel de detalle según el zoom (mín/máx por tramo)
     plt.figure(figsize=(12, 6))
-    plt.plot(tiempos, muestras, color='b', label="Señal EEG (mV)")
+    lod = LODPlot(plt.gca(), muestras, tiempos, cache_path=csv_filename + '.lod.npz', source=csv_filename,
+                  color='b', label="Señal EEG (mV)")
     plt.xlabel("Tiempo (s)")
     plt.ylabel("Amplitud (mV)")
     plt.title("Señal EEG en el tiempo")
@@ -134,16 +113,9 @@ def transformada_fourier(filename):
     print("Applying Fourier Transform...")
     # Cargar datos desde el archivo CSV
 
-    archivo_csv = f'/Users/pedrogonzaleznunez/Documents/GitHub/EEG_Signals/{csv_filename}'
-
-    # datos = pd.read_csv(archivo_csv, delimiter=',', names=['Repetition','Sample Value Filtered','FPS'])
-    datos = pd.read_csv(archivo_csv, delimiter=',', header=0)
-
     # Extraer la señal EEG
-    # eeg_signal = datos['Sample Value'].values
-    #eeg_signal = pd.to_numeric(datos['Sample Value Filtered'], errors='coerce')
-    eeg_signal = datos['Sample Value Filtered'].apply(lambda x: float(x.strip('[]')))
-    eeg_signal = eeg_signal.dropna().values  # Elimina filas con valores NaN
+    repetitions, eeg_signal, tiempos = load_signal(filename, skip_negative=False)
+    eeg_signal = eeg_signal[~np.isnan(eeg_signal)]  # Elimina filas con valores NaN
 
     Fs = 250.0  # Frecuencia de muestreo en Hz
     N = len(eeg_signal)  # Número de muestras
@@ -167,7 +139,7 @@ def stop_streaming():
 
 if __name__ == '__main__':
 
-    global patient_name, csv_filename, repetitions, fs, lowcut, highcut
+    global patient_name, csv_filename, repetitions, fs, lowcut, highcut, alpha_filter, recorder
 
     repetitions = 0
     fs = 250.0
@@ -177,14 +149,16 @@ if __name__ == '__main__':
     # Filtros para señales alpha
     lowcut = 8.0  # Límite inferior del filtro
     highcut = 12.0  # Límite superior del filtro
+    alpha_filter = StreamingFilter(bandpass_sos(lowcut, highcut, fs))
 
-    create_csv(csv_filename)
     try:
         board = OpenBCIBoard()
         board.print_register_settings()
     except Exception as e:
         print("Error al inicializar OpenBCI:")
         traceback.print_exc()
+    recorder = Recorder(csv_filename, board=board, value_column='Sample Value Filtered')
+    metrics.attach(board)
 
     board.get_radio_channel_number()
     print(f'OpenBCI connected to radio channel {board.radio_channel_number}')